@@ -1,9 +1,13 @@
 import xml.etree.ElementTree as elemtree
 from datetime import datetime
 import requests, time, sys, os, re, math, json, base64, urllib, io
-import mapbox
+import concurrent.futures, threading, collections, collections.abc, array
+import mapbox, tile_cache, http_client
 from routemap import convert_gps, convert_pos, Mapframe, RouteMap
 
+# fetch_route_bundle의 결과
+RouteBundle = collections.namedtuple('RouteBundle', ['route_positions', 'route_info', 'bus_stops'])
+
 class ApiKeyError(Exception):
     pass
 
@@ -25,6 +29,33 @@ route_type_str = {0: '공용', 1: '공항', 2: '마을', 3: '간선', 4: '지선
     61: '일반', 62: '급행', 63: '좌석', 64: '심야', 65: '마을'}
 
 cache_dir = 'cache'
+# 타일 캐시 용량 한도(바이트)와 유효 기간(초), None이면 제한 없음
+cache_max_bytes = 512 * 1024 ** 2
+cache_ttl = 30 * 86400
+# 렌더링 뒤 캐시 정리는 사용량 추정치가 한도를 넘거나 이 간격(초)이 지났을 때만 전체 항목을 읽어서 수행
+cache_prune_interval = 3600
+# 지정하면 타일 파일 대신 하나의 SQLite(MBTiles) 파일에 저장, 예: 'cache/tiles.mbtiles'
+cache_mbtiles = None
+# NumPy가 있으면 필터와 스타일 속성을 레이어 단위로 한 번에 계산
+vectorize_filters = False
+
+# 노선형상, 노선정보, 정류장 목록 캐시: (지역, 노선 ID, 항목)마다 파일 하나
+route_cache_dir = os.path.join(cache_dir, 'routes')
+# 캐시 유효 기간(초), 지나면 다시 조회하되 route_cache_stale_while_revalidate이면 캐시를 먼저 사용하고 백그라운드에서 갱신
+route_cache_ttl = 7 * 86400
+route_cache_stale_while_revalidate = True
+route_cache_lock = threading.Lock()
+route_cache_revalidating = set()
+
+# 지역별 노선 검색 제한 시간 (초), 부산은 재시도를 포함
+search_timeouts = {'seoul': 10, 'gyeonggi': 10, 'busan': 30}
+
+# 타일 미리 받기(seed)용 지역 범위 (서쪽 경도, 남쪽 위도, 동쪽 경도, 북쪽 위도)
+seed_regions = {
+    'seoul': (126.76, 37.41, 127.19, 37.72),
+    'gyeonggi': (126.37, 36.89, 127.86, 38.30),
+    'busan': (128.76, 34.87, 129.32, 35.40)
+}
 
 def convert_busan_bus_type(type_str):
     if type_str[:2] == '일반':
@@ -40,6 +71,15 @@ def convert_busan_bus_type(type_str):
     else:
         return 0
 
+def convert_type_to_region_id(route_type):
+    # fetch_route_bundle, search_timeouts에서 사용하는 지역 이름
+    if route_type <= 10:
+        return 'seoul'
+    elif route_type <= 60:
+        return 'gyeonggi'
+    else:
+        return 'busan'
+
 def convert_type_to_region(route_type):
     if route_type <= 10:
         return '서울'
@@ -51,7 +91,7 @@ def convert_type_to_region(route_type):
 def check_seoul_key_valid(key):
     params = {'serviceKey': key}
     
-    route_api_res = requests.get('http://ws.bus.go.kr/api/rest/busRouteInfo/getStaionByRoute', params = params).text
+    route_api_res = http_client.get('http://ws.bus.go.kr/api/rest/busRouteInfo/getStaionByRoute', params = params).text
     route_api_tree = elemtree.fromstring(route_api_res)
 
     api_err = int(route_api_tree.find('./msgHeader/headerCd').text)
@@ -62,7 +102,7 @@ def check_seoul_key_valid(key):
 
 def check_gyeonggi_key_valid(key):
     params = {'serviceKey': key}
-    route_api_res = requests.get('http://apis.data.go.kr/6410000/busrouteservice/v2/getBusRouteStationListv2', params = params, timeout = 20)
+    route_api_res = http_client.get('http://apis.data.go.kr/6410000/busrouteservice/v2/getBusRouteStationListv2', params = params)
 
     if route_api_res.headers.get('Content-Type').startswith('text/xml'):
         route_api_tree = elemtree.fromstring(route_api_res.text)
@@ -75,7 +115,7 @@ def check_gyeonggi_key_valid(key):
 
 def check_busan_key_valid(key):
     params = {'serviceKey': key}
-    route_api_res = requests.get('https://apis.data.go.kr/6260000/BusanBIMS/busInfoByRouteId', params = params, timeout = 20).text
+    route_api_res = http_client.get('https://apis.data.go.kr/6260000/BusanBIMS/busInfoByRouteId', params = params).text
     route_api_tree = elemtree.fromstring(route_api_res)
     
     api_err = route_api_tree.find('./cmmMsgHeader/returnAuthMsg')
@@ -87,7 +127,7 @@ def get_seoul_bus_stops(key, routeid):
     # 서울 버스 정류장 목록 조회
     params = {'serviceKey': key, 'busRouteId': routeid}
     
-    route_api_res = requests.get('http://ws.bus.go.kr/api/rest/busRouteInfo/getStaionByRoute', params = params).text
+    route_api_res = http_client.get('http://ws.bus.go.kr/api/rest/busRouteInfo/getStaionByRoute', params = params).text
     route_api_tree = elemtree.fromstring(route_api_res)
 
     api_err = int(route_api_tree.find('./msgHeader/headerCd').text)
@@ -117,7 +157,7 @@ def get_gyeonggi_bus_stops(key, routeid):
     # 경기 버스 정류장 목록 조회
     params = {'serviceKey': key, 'routeId': routeid, 'format': 'xml'}
     
-    route_api_res = requests.get('http://apis.data.go.kr/6410000/busrouteservice/v2/getBusRouteStationListv2', params = params, timeout = 20)
+    route_api_res = http_client.get('http://apis.data.go.kr/6410000/busrouteservice/v2/getBusRouteStationListv2', params = params)
     if not (route_api_res.headers.get('Content-Type').startswith('text/xml') or route_api_res.headers.get('Content-Type').startswith('application/xml')):
         return []
 
@@ -153,15 +193,33 @@ def get_gyeonggi_bus_stops(key, routeid):
     
     return bus_stops
 
-def get_busan_bus_stops(key, route_id, route_bims_id):
-    # 부산 버스 정류장 목록 조회
+def get_busan_bus_line_list(route_bims_id):
+    # 부산 BIMS 노선 조회, 첫 줄은 노선 정보이고 세 번째 줄부터 정류장 목록
     params = {'optBusNum': route_bims_id}
     
-    route_api_res = requests.get('http://bus.busan.go.kr/busanBIMS/Ajax/busLineList.asp', params = params, timeout = 20).text
+    route_api_res = http_client.get('http://bus.busan.go.kr/busanBIMS/Ajax/busLineList.asp', params = params).text
     route_api_tree = elemtree.fromstring(route_api_res)
 
-    bus_stop_items = route_api_tree.findall('./line')
+    return route_api_tree.findall('./line')
+
+def get_busan_bus_trans_index(key, route_id):
+    # 부산 버스 회차 정류장 순번 (0부터), 없으면 None
+    params = {'serviceKey': key, 'lineid': route_id}
+    route_api_res = http_client.get('https://apis.data.go.kr/6260000/BusanBIMS/busInfoByRouteId', params = params).text
+    route_api_tree = elemtree.fromstring(route_api_res)
+    
+    api_common_err = route_api_tree.find('./cmmMsgHeader/returnAuthMsg')
+    if api_common_err != None:
+        raise BusanApiKeyError(api_common_err.text)
+    
+    bus_stop_items = route_api_tree.findall('./body/items/item')
+    for i in bus_stop_items:
+        if i.find('./rpoint').text == '1':
+            return int(i.find('./bstopidx').text) - 1
     
+    return None
+
+def parse_busan_bus_stops(bus_stop_items, trans_index):
     bus_stops = []
     for i in bus_stop_items[2:]:
         stop = {}
@@ -173,27 +231,20 @@ def get_busan_bus_stops(key, route_id, route_bims_id):
         
         bus_stops.append(stop)
     
-    params2 = {'serviceKey': key, 'lineid': route_id}
-    route_api_res2 = requests.get('https://apis.data.go.kr/6260000/BusanBIMS/busInfoByRouteId', params = params2, timeout = 20).text
-    route_api_tree2 = elemtree.fromstring(route_api_res2)
-    
-    api_common_err = route_api_tree2.find('./cmmMsgHeader/returnAuthMsg')
-    if api_common_err != None:
-        raise BusanApiKeyError(api_common_err.text)
-    
-    bus_stop_items2 = route_api_tree2.findall('./body/items/item')
-    for i in bus_stop_items2:
-        if i.find('./rpoint').text == '1':
-            bus_stops[int(i.find('./bstopidx').text) - 1]['is_trans'] = True
-            break
+    if trans_index != None:
+        bus_stops[trans_index]['is_trans'] = True
     
     return bus_stops
 
+def get_busan_bus_stops(key, route_id, route_bims_id):
+    # 부산 버스 정류장 목록 조회
+    return parse_busan_bus_stops(get_busan_bus_line_list(route_bims_id), get_busan_bus_trans_index(key, route_id))
+
 def get_seoul_bus_type(key, routeid):
     # 서울 버스 노선정보 조회
     params = {'serviceKey': key, 'busRouteId': routeid}
     
-    route_api_res = requests.get('http://ws.bus.go.kr/api/rest/busRouteInfo/getRouteInfo', params = params).text
+    route_api_res = http_client.get('http://ws.bus.go.kr/api/rest/busRouteInfo/getRouteInfo', params = params).text
     route_api_tree = elemtree.fromstring(route_api_res)
 
     api_err = int(route_api_tree.find('./msgHeader/headerCd').text)
@@ -218,7 +269,7 @@ def get_gyeonggi_bus_type(key, routeid):
     # 경기 버스 노선정보 조회
     params = {'serviceKey': key, 'routeId': routeid, 'format': 'xml'}
     
-    route_api_res = requests.get('http://apis.data.go.kr/6410000/busrouteservice/v2/getBusRouteInfoItemv2', params = params, timeout = 20)
+    route_api_res = http_client.get('http://apis.data.go.kr/6410000/busrouteservice/v2/getBusRouteInfoItemv2', params = params)
     if not (route_api_res.headers.get('Content-Type').startswith('text/xml') or route_api_res.headers.get('Content-Type').startswith('application/xml')):
         return []
 
@@ -243,15 +294,7 @@ def get_gyeonggi_bus_type(key, routeid):
     
     return route_info
 
-def get_busan_bus_type(key, route_bims_id):
-    # 부산 버스 노선정보 조회
-    params = {'optBusNum': route_bims_id}
-    
-    route_api_res = requests.get('http://bus.busan.go.kr/busanBIMS/Ajax/busLineList.asp', params = params, timeout = 20).text
-    route_api_tree = elemtree.fromstring(route_api_res)
-
-    bus_stop_items = route_api_tree.findall('./line')
-    
+def parse_busan_bus_type(bus_stop_items):
     bus_info_tree = bus_stop_items[0]
     route_info = {}
     
@@ -262,31 +305,114 @@ def get_busan_bus_type(key, route_bims_id):
     
     return route_info
 
+def get_busan_bus_type(key, route_bims_id):
+    # 부산 버스 노선정보 조회
+    return parse_busan_bus_type(get_busan_bus_line_list(route_bims_id))
+
+class CoordinateArray(collections.abc.Sequence):
+    # (x, y) 좌표 목록, array('d') 하나에 x, y를 번갈아 저장해서 튜플을 점마다 만들지 않음
+    def __init__(self, positions = ()):
+        self.values = array.array('d')
+        for pos in positions:
+            self.append(pos)
+    
+    def append(self, pos):
+        self.values.append(pos[0])
+        self.values.append(pos[1])
+    
+    def __len__(self):
+        return len(self.values) // 2
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        
+        if index < 0:
+            index += len(self)
+        
+        if index < 0 or index >= len(self):
+            raise IndexError('coordinate index out of range')
+        
+        return (self.values[index * 2], self.values[index * 2 + 1])
+    
+    def __iter__(self):
+        values = iter(self.values)
+        return zip(values, values)
+    
+    def __eq__(self, other):
+        return isinstance(other, collections.abc.Sequence) and list(self) == list(other)
+    
+    def tolist(self):
+        return list(self)
+
+def json_default(value):
+    # json.dump의 default: CoordinateArray는 [[x, y], ...]로 저장
+    if isinstance(value, CoordinateArray):
+        return value.tolist()
+    raise TypeError('Object of type {} is not JSON serializable'.format(value.__class__.__name__))
+
+def parse_route_positions(response, item_tag, x_tag, y_tag):
+    # DOM을 만들지 않고 응답을 조각 단위로 파싱, 노선형상 항목은 좌표만 꺼내고 바로 지움
+    # 항목 밖의 값(오류 코드 등)은 (루트 아래 경로 -> 텍스트)로 반환
+    # response는 http_client.get(stream = True)의 응답이며, 다 읽은 뒤 닫음
+    parser = elemtree.XMLPullParser(events = ('start', 'end'))
+    route_positions = CoordinateArray()
+    header = {}
+    elements = []
+    # 현재 항목 안에 있으면 [x, y], 항목 밖이면 None
+    pos = None
+    
+    def read_events():
+        nonlocal pos
+        
+        for event, elem in parser.read_events():
+            if event == 'start':
+                elements.append(elem)
+                
+                if elem.tag == item_tag:
+                    pos = [None, None]
+                continue
+            
+            elements.pop()
+            
+            if pos == None:
+                if elements:
+                    header['/'.join([parent.tag for parent in elements[1:]] + [elem.tag])] = elem.text
+            elif elem.tag == x_tag:
+                pos[0] = float(elem.text)
+            elif elem.tag == y_tag:
+                pos[1] = float(elem.text)
+            elif elem.tag == item_tag:
+                route_positions.append(pos)
+                pos = None
+                elements[-1].remove(elem)
+    
+    try:
+        for chunk in response.iter_content(chunk_size = 65536):
+            parser.feed(chunk)
+            read_events()
+    finally:
+        response.close()
+    
+    parser.close()
+    read_events()
+    
+    return route_positions, header
+
 def get_seoul_bus_route(key, routeid):
     # 서울 버스 노선형상 조회
     params = {'serviceKey': key, 'busRouteId': routeid}
     
-    route_api_res = requests.get('http://ws.bus.go.kr/api/rest/busRouteInfo/getRoutePath', params = params).text
-    route_api_tree = elemtree.fromstring(route_api_res)
+    route_api_res = http_client.get('http://ws.bus.go.kr/api/rest/busRouteInfo/getRoutePath', params = params, stream = True)
+    route_positions, header = parse_route_positions(route_api_res, 'itemList', 'gpsX', 'gpsY')
 
-    api_err = int(route_api_tree.find('./msgHeader/headerCd').text)
+    api_err = int(header['msgHeader/headerCd'])
 
     if api_err == 7:
         raise SeoulApiKeyError()
 
     if api_err != 0 and api_err != 4:
-        raise ValueError(route_api_tree.find('./msgHeader/headerMsg').text)
-
-    route_api_body = route_api_tree.find('./msgBody')
-    xml_route_positions = route_api_body.findall('./itemList')
-
-    route_positions = []
-
-    for i in xml_route_positions:
-        x = float(i.find('./gpsX').text)
-        y = float(i.find('./gpsY').text)
-        
-        route_positions.append((x, y))
+        raise ValueError(header.get('msgHeader/headerMsg'))
     
     return route_positions
 
@@ -294,31 +420,20 @@ def get_gyeonggi_bus_route(key, routeid):
     # 경기 버스 노선형상 조회
     params = {'serviceKey': key, 'routeId': routeid, 'format': 'xml'}
     
-    route_api_res = requests.get('http://apis.data.go.kr/6410000/busrouteservice/v2/getBusRouteLineListv2', params = params, timeout = 20)
+    route_api_res = http_client.get('http://apis.data.go.kr/6410000/busrouteservice/v2/getBusRouteLineListv2', params = params, stream = True)
     if not (route_api_res.headers.get('Content-Type').startswith('text/xml') or route_api_res.headers.get('Content-Type').startswith('application/xml')):
-        return []
+        route_api_res.close()
+        return CoordinateArray()
     
-    route_api_tree = elemtree.fromstring(route_api_res.text)
+    route_positions, header = parse_route_positions(route_api_res, 'busRouteLineList', 'x', 'y')
     
-    api_common_err = route_api_tree.find('./cmmMsgHeader/returnAuthMsg')
-    if api_common_err != None:
-        raise GyeonggiApiKeyError(api_common_err.text)
+    if 'cmmMsgHeader/returnAuthMsg' in header:
+        raise GyeonggiApiKeyError(header['cmmMsgHeader/returnAuthMsg'])
 
-    api_err = int(route_api_tree.find('./msgHeader/resultCode').text)
+    api_err = int(header['msgHeader/resultCode'])
 
     if api_err != 0 and api_err != 4:
-        raise ValueError(route_api_tree.find('./msgHeader/resultMessage').text)
-
-    route_api_body = route_api_tree.find('./msgBody')
-    xml_route_positions = route_api_body.findall('./busRouteLineList')
-
-    route_positions = []
-
-    for i in xml_route_positions:
-        x = float(i.find('./x').text)
-        y = float(i.find('./y').text)
-        
-        route_positions.append((x, y))
+        raise ValueError(header.get('msgHeader/resultMessage'))
     
     return route_positions
 
@@ -327,7 +442,7 @@ def get_busan_bus_route(route_name):
     params = {'busLineId': route_name}
     encoded_params = urllib.parse.urlencode(params, encoding='cp949')
     
-    route_api_res = requests.get('http://bus.busan.go.kr/busanBIMS/Ajax/busLineCoordList.asp?' + encoded_params, timeout = 5).text
+    route_api_res = http_client.get('http://bus.busan.go.kr/busanBIMS/Ajax/busLineCoordList.asp?' + encoded_params).text
     route_api_tree = elemtree.fromstring(route_api_res)
     xml_route_positions = route_api_tree.findall('./coord')
     
@@ -345,10 +460,135 @@ def get_busan_bus_route(route_name):
     
     return route_positions, route_bims_id
 
-def search_seoul_bus_info(key, number):
+def request_route_bundle(key, region, route_id, route_name = None):
+    # 노선형상, 노선정보, 정류장 목록을 동시에 조회
+    # 부산은 노선형상 조회에서 얻는 BIMS 노선 ID가 필요한 요청만 그 뒤에 실행하고, 노선정보와 정류장 목록은 같은 응답을 사용
+    with concurrent.futures.ThreadPoolExecutor(max_workers = 3) as executor:
+        if region == 'seoul':
+            route_positions = executor.submit(get_seoul_bus_route, key, route_id)
+            route_info = executor.submit(get_seoul_bus_type, key, route_id)
+            bus_stops = executor.submit(get_seoul_bus_stops, key, route_id)
+            
+            return RouteBundle(route_positions.result(), route_info.result(), bus_stops.result())
+        elif region == 'gyeonggi':
+            route_positions = executor.submit(get_gyeonggi_bus_route, key, route_id)
+            route_info = executor.submit(get_gyeonggi_bus_type, key, route_id)
+            bus_stops = executor.submit(get_gyeonggi_bus_stops, key, route_id)
+            
+            return RouteBundle(route_positions.result(), route_info.result(), bus_stops.result())
+        elif region == 'busan':
+            route = executor.submit(get_busan_bus_route, route_name)
+            trans_index = executor.submit(get_busan_bus_trans_index, key, route_id)
+            
+            route_positions, route_bims_id = route.result()
+            bus_stop_items = get_busan_bus_line_list(route_bims_id)
+            
+            return RouteBundle(route_positions, parse_busan_bus_type(bus_stop_items), parse_busan_bus_stops(bus_stop_items, trans_index.result()))
+    
+    raise ValueError('Unknown region: {}'.format(region))
+
+def get_route_cache_filename(region, route_id, endpoint):
+    return os.path.join(route_cache_dir, region, '{}-{}.json'.format(route_id, endpoint))
+
+def read_route_cache(region, route_id):
+    # (가장 오래된 조회 시각, RouteBundle), 하나라도 없으면 None
+    fetched = None
+    values = []
+    
+    for endpoint in RouteBundle._fields:
+        try:
+            with open(get_route_cache_filename(region, route_id, endpoint), mode='r', encoding='utf-8') as f:
+                cache_json = json.load(f)
+            values.append(cache_json['data'])
+            fetched = cache_json['fetched'] if fetched == None else min(fetched, cache_json['fetched'])
+        except (OSError, ValueError, KeyError):
+            return None
+    
+    route_positions, route_info, bus_stops = values
+    
+    # JSON에서 리스트로 바뀐 좌표를 원래대로 튜플로 변환
+    if route_positions != None:
+        route_positions = CoordinateArray(route_positions) if region != 'busan' else [tuple(pos) for pos in route_positions]
+    
+    for stop in bus_stops:
+        stop['pos'] = tuple(stop['pos'])
+    
+    return fetched, RouteBundle(route_positions, route_info, bus_stops)
+
+def is_route_bundle_valid(bundle):
+    # 형상, 노선정보, 정류장 목록 중 하나라도 비어 있거나 잘못된 응답은 캐시하지 않음
+    # 정류장이 없는 노선은 없으므로 빈 정류장 목록은 조회 실패(503 페이지 등)로 취급
+    route_positions, route_info, bus_stops = bundle
+    
+    if route_positions == None or len(route_positions) == 0:
+        return False
+    
+    if not isinstance(route_info, dict) or not route_info:
+        return False
+    
+    return isinstance(bus_stops, list) and len(bus_stops) > 0
+
+def write_route_cache(region, route_id, fetched, bundle):
+    os.makedirs(os.path.join(route_cache_dir, region), exist_ok = True)
+    
+    for endpoint, data in zip(RouteBundle._fields, bundle):
+        # 백그라운드 갱신과 새로 조회한 결과를 동시에 저장할 수 있으므로 고유한 임시 파일을 사용
+        with tile_cache.atomic_write(get_route_cache_filename(region, route_id, endpoint)) as f:
+            json.dump({'fetched': fetched, 'data': data}, f, ensure_ascii = False, default = json_default)
+
+def revalidate_route_cache(key, region, route_id, route_name):
+    try:
+        fetched = time.time()
+        bundle = request_route_bundle(key, region, route_id, route_name)
+        
+        if is_route_bundle_valid(bundle):
+            write_route_cache(region, route_id, fetched, bundle)
+    except Exception:
+        # 갱신에 실패하면 다음에 다시 시도
+        pass
+    finally:
+        with route_cache_lock:
+            route_cache_revalidating.discard((region, route_id))
+
+def fetch_route_bundle(key, region, route_id, route_name = None, refresh = False):
+    # 캐시가 route_cache_ttl 안이면 네트워크 요청 없이 반환
+    # 기간이 지났으면 route_cache_stale_while_revalidate일 때 캐시를 먼저 반환하고 백그라운드에서 갱신
+    # refresh이면 캐시를 무시하고 새로 조회해서 저장
+    if not refresh:
+        cached = read_route_cache(region, route_id)
+        
+        if cached:
+            fetched, bundle = cached
+            
+            if time.time() - fetched < route_cache_ttl:
+                return bundle
+            
+            if route_cache_stale_while_revalidate:
+                with route_cache_lock:
+                    revalidate = (region, route_id) not in route_cache_revalidating
+                    route_cache_revalidating.add((region, route_id))
+                
+                if revalidate:
+                    thread = threading.Thread(target = revalidate_route_cache, args = (key, region, route_id, route_name), daemon = True)
+                    thread.start()
+                
+                return bundle
+    
+    fetched = time.time()
+    bundle = request_route_bundle(key, region, route_id, route_name)
+    
+    if is_route_bundle_valid(bundle):
+        try:
+            write_route_cache(region, route_id, fetched, bundle)
+        except OSError:
+            pass
+    
+    return bundle
+
+def search_seoul_bus_info(key, number, timeout = None):
     params = {'serviceKey': key, 'strSrch': number}
     
-    list_api_res = requests.get('http://ws.bus.go.kr/api/rest/busRouteInfo/getBusRouteList', params = params).text
+    list_api_res = http_client.get('http://ws.bus.go.kr/api/rest/busRouteInfo/getBusRouteList', params = params, timeout = timeout).text
     list_api_tree = elemtree.fromstring(list_api_res)
 
     api_err = int(list_api_tree.find('./msgHeader/headerCd').text)
@@ -378,13 +618,13 @@ def search_seoul_bus_info(key, number):
     
     return bus_info_list
 
-def search_gyeonggi_bus_info(key, number):
+def search_gyeonggi_bus_info(key, number, timeout = None):
     bus_info_list = []
     
     try:
         params = {'serviceKey': key, 'keyword': number, 'format': 'xml'}
 
-        list_api_res = requests.get('http://apis.data.go.kr/6410000/busrouteservice/v2/getBusRouteListv2', params = params, timeout = 5)
+        list_api_res = http_client.get('http://apis.data.go.kr/6410000/busrouteservice/v2/getBusRouteListv2', params = params, timeout = timeout)
         if not (list_api_res.headers.get('Content-Type').startswith('text/xml') or list_api_res.headers.get('Content-Type').startswith('application/xml')):
             return []
         
@@ -415,85 +655,55 @@ def search_gyeonggi_bus_info(key, number):
     
     return bus_info_list
 
-def search_busan_bus_info(key, number):
+def search_busan_bus_info(key, number, timeout = None):
     bus_info_list = []
     params = {'serviceKey': key, 'lineno': number}
     
-    success = False
+    # 503 페이지는 http_client에서 재시도, timeout이 주어지면 재시도를 포함한 전체 시간을 제한
+    deadline = time.time() + timeout if timeout != None else None
     
-    for i in range(20):
-        try:
-            list_api_res = requests.get('http://apis.data.go.kr/6260000/BusanBIMS/busInfo', params = params).text
-            if list_api_res.find('http://apis.data.go.kr/503.html') != -1:
-                raise ServerError('503 Server Unavailable')
-                
-            list_api_tree = elemtree.fromstring(list_api_res)
-            
-            api_common_err = list_api_tree.find('./cmmMsgHeader/returnAuthMsg')
-            if api_common_err != None:
-                raise BusanApiKeyError(api_common_err.text)
-            
-            api_err = int(list_api_tree.find('./header/resultCode').text)
-            
-            if api_err != 0:
-                raise ValueError(list_api_tree.find('./header/resultMsg').text)
-            
-            xml_bus_list = list_api_tree.findall('./body/items/item')
-            
-            for i in xml_bus_list:
-                name = i.find('./buslinenum').text
-                route_id = i.find('./lineid').text
+    list_api_res = http_client.get('http://apis.data.go.kr/6260000/BusanBIMS/busInfo', params = params, timeout = timeout, deadline = deadline).text
+    if list_api_res.find('http://apis.data.go.kr/503.html') != -1:
+        raise ServerError('503 Server Unavailable')
+        
+    list_api_tree = elemtree.fromstring(list_api_res)
+    
+    api_common_err = list_api_tree.find('./cmmMsgHeader/returnAuthMsg')
+    if api_common_err != None:
+        raise BusanApiKeyError(api_common_err.text)
+    
+    api_err = int(list_api_tree.find('./header/resultCode').text)
+    
+    if api_err != 0:
+        raise ValueError(list_api_tree.find('./header/resultMsg').text)
+    
+    xml_bus_list = list_api_tree.findall('./body/items/item')
+    
+    for i in xml_bus_list:
+        name = i.find('./buslinenum').text
+        route_id = i.find('./lineid').text
 
-                start_elem = i.find('./startpoint')
-                start = start_elem.text if start_elem is not None else ''
+        start_elem = i.find('./startpoint')
+        start = start_elem.text if start_elem is not None else ''
 
-                end_elem = i.find('./endpoint')
-                end = end_elem.text if end_elem is not None else ''
+        end_elem = i.find('./endpoint')
+        end = end_elem.text if end_elem is not None else ''
 
-                route_type = convert_busan_bus_type(i.find('./bustype').text)
-                
-                bus_info_list.append({'name': name, 'id': route_id, 'desc': start + '~' + end, 'type': route_type})
-        except Exception as e:
-            error = e
-            continue
-        else:
-            success = True
-            break
-    
-    if not success:
-        raise error
+        route_type = convert_busan_bus_type(i.find('./bustype').text)
+        
+        bus_info_list.append({'name': name, 'id': route_id, 'desc': start + '~' + end, 'type': route_type})
     
     return bus_info_list
 
-def search_bus_info(key, number, return_error = False):
-    bus_info_list = []
-    exception = None
+def search_bus_info(key, number, return_error = False, callback = None):
+    # 지역별 검색을 동시에 실행, search_timeouts 안에 끝나지 않은 지역은 기다리지 않고 오류로 처리
+    # callback이 주어지면 지역 검색이 끝날 때마다 지금까지의 결과를 callback(정렬된 목록, 오류)로 전달
+    searches = [
+        ('seoul', '서울', search_seoul_bus_info),
+        ('gyeonggi', '경기', search_gyeonggi_bus_info),
+        ('busan', '부산', search_busan_bus_info),
+    ]
     
-    # 서울 버스 조회
-    try:
-        bus_info_list += search_seoul_bus_info(key, number)
-    except ApiKeyError as api_err:
-        exception = api_err
-    except Exception as e:
-        exception = ValueError('서울 버스 정보를 조회하는 중 오류가 발생했습니다: ' + str(e))
-    
-    # 경기 버스 조회
-    try:
-        bus_info_list += search_gyeonggi_bus_info(key, number)
-    except ApiKeyError as api_err:
-        exception = api_err
-    except Exception as e:
-        exception = ValueError('경기 버스 정보를 조회하는 중 오류가 발생했습니다: ' + str(e))
-    
-    # 부산 버스 조회
-    try:
-        bus_info_list += search_busan_bus_info(key, number)
-    except ApiKeyError as api_err:
-        exception = api_err
-    except Exception as e:
-        exception = ValueError('부산 버스 정보를 조회하는 중 오류가 발생했습니다: ' + str(e))
-        raise
-        
     rx_number = re.compile('[0-9]+')
     is_number = bool(re.match('[0-9]+$', number))
         
@@ -522,10 +732,62 @@ def search_bus_info(key, number, return_error = False):
             else:
                 return x['name']
     
-    if return_error:
+    results = {}
+    errors = {}
+    
+    def merge_results():
+        # 서울, 경기, 부산 순서로 합친 뒤 정렬, 오류는 마지막 지역의 것을 사용
+        bus_info_list = []
+        exception = None
+        
+        for region, region_name, search in searches:
+            bus_info_list += results.get(region, [])
+            exception = errors.get(region, exception)
+        
         return sorted(bus_info_list, key=search_score), exception
+    
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers = len(searches))
+    try:
+        start = time.time()
+        futures = {}
+        for region, region_name, search in searches:
+            futures[executor.submit(search, key, number, timeout = search_timeouts[region])] = (region, region_name)
+        
+        pending = set(futures)
+        
+        while pending:
+            deadline = min(start + search_timeouts[futures[future][0]] for future in pending)
+            done, pending = concurrent.futures.wait(pending, timeout = max(0, deadline - time.time()), return_when = concurrent.futures.FIRST_COMPLETED)
+            
+            for future in done:
+                region, region_name = futures[future]
+                
+                try:
+                    results[region] = future.result()
+                except ApiKeyError as api_err:
+                    errors[region] = api_err
+                except Exception as e:
+                    errors[region] = ValueError('{} 버스 정보를 조회하는 중 오류가 발생했습니다: {}'.format(region_name, e))
+            
+            timed_out = [future for future in pending if start + search_timeouts[futures[future][0]] <= time.time()]
+            
+            for future in timed_out:
+                region, region_name = futures[future]
+                errors[region] = ValueError('{} 버스 정보를 조회하는 시간이 초과되었습니다.'.format(region_name))
+                pending.remove(future)
+            
+            if callback != None and (done or timed_out):
+                callback(*merge_results())
+    finally:
+        # 시간이 초과된 검색은 끝날 때까지 기다리지 않음
+        executor.shutdown(wait = False)
+    
+    bus_info_list, exception = merge_results()
+    
+    if return_error:
+        return bus_info_list, exception
     else:
-        return sorted(bus_info_list, key=search_score)
+        return bus_info_list
 
 def get_naver_map(mapframe, naver_key_id, naver_key):
     route_size = mapframe.size()
@@ -552,7 +814,7 @@ def get_naver_map(mapframe, naver_key_id, naver_key):
     
     for p in map_part:
         gps_pos = convert_gps((pos[0] + k * p[0], pos[1] + k * p[1]))
-        map_img.append(requests.get('https://naveropenapi.apigw.ntruss.com/map-static/v2/raster?w=1024&h=1024&center={},{}&level={}&format=png&scale=2'.format(gps_pos[0], gps_pos[1], level), 
+        map_img.append(http_client.get('https://naveropenapi.apigw.ntruss.com/map-static/v2/raster?w=1024&h=1024&center={},{}&level={}&format=png&scale=2'.format(gps_pos[0], gps_pos[1], level), 
             headers={'X-NCP-APIGW-API-KEY-ID': naver_key_id, 'X-NCP-APIGW-API-KEY': naver_key}).content)
     
     result = ''
@@ -562,7 +824,294 @@ def get_naver_map(mapframe, naver_key_id, naver_key):
     
     return result
 
-def get_mapbox_map(mapframe, mapbox_key, mapbox_style):
+def get_tile_clip_rect(mapframe, pos_x, pos_y, tile_size):
+    # 노선도 영역을 타일 좌표계(y축 위쪽)로 변환, 타일 전체가 영역 안에 있으면 None
+    scale = 4096 / tile_size
+    border = 16
+    
+    x1 = max(math.floor((mapframe.left - pos_x) * scale), -border)
+    x2 = min(math.ceil((mapframe.right - pos_x) * scale), 4096 + border)
+    y1 = max(math.floor(4096 - (mapframe.bottom - pos_y) * scale), -border)
+    y2 = min(math.ceil(4096 - (mapframe.top - pos_y) * scale), 4096 + border)
+    
+    if x1 <= 0 and y1 <= 0 and x2 >= 4096 and y2 >= 4096:
+        return None
+    
+    return (x1, y1, x2, y2)
+
+def fetch_mapbox_tile(styles, mapbox_key, x, y, level, tile_store, session, timeout, refresh = False, overzoom = False, prefer_cache = False):
+    # (MVT, 상위 타일 줌 레벨) 반환, 정확한 타일이면 상위 타일 줌 레벨은 None
+    # overzoom이면 타일을 받지 못했을 때 캐시에 있는 상위 타일을 대신 사용
+    # prefer_cache이면 네트워크를 기다리지 않고 바로 상위 타일을 사용
+    if prefer_cache and not refresh:
+        data = tile_store.get_tile(mapbox.get_tile_source(styles), x, y, level)
+        if data != None:
+            return data, None
+        
+        parent = mapbox.find_parent_tile(styles, tile_store, x, y, level)
+        if parent:
+            return parent
+    
+    try:
+        return mapbox.fetch_tile(styles, mapbox_key, x, y, level, tile_store = tile_store, session = session, timeout = timeout, refresh = refresh), None
+    except (mapbox.MapBoxError, requests.exceptions.RequestException):
+        parent = mapbox.find_parent_tile(styles, tile_store, x, y, level) if overzoom else None
+        if parent == None:
+            raise
+        return parent
+
+def is_fragment_current(header, revision):
+    return header.get('revision') == revision and header.get('renderer') == mapbox.renderer_version
+
+def render_mapbox_tile(styles, mapbox_style, mapbox_key, x, y, level, tile_store, session, timeout, render_executor = None, clip_rect = None, merge_paths = True, refresh = False, overzoom = False, prefer_cache = False):
+    # 상위 타일로 대신한 타일은 저장하지 않으며, 헤더의 parent_zoom으로 구분
+    data, parent_zoom = fetch_mapbox_tile(styles, mapbox_key, x, y, level, tile_store, session, timeout, refresh = refresh, overzoom = overzoom, prefer_cache = prefer_cache)
+    
+    if render_executor:
+        body, css, sprites = render_executor.submit(mapbox.render_fragment_worker, data, x, y, level, clip_rect = clip_rect, merge_paths = merge_paths, parent_zoom = parent_zoom, vectorize = vectorize_filters).result()
+    else:
+        body, css, sprites = mapbox.render_tile_fragment(styles, data, x, y, level, clip_rect = clip_rect, merge_paths = merge_paths, parent_zoom = parent_zoom, vectorize = vectorize_filters)
+    
+    if parent_zoom == None:
+        tile_store.put_fragment(mapbox_style, x, y, level, body, css, revision = mapbox.get_style_revision(styles), clip_rect = clip_rect, sprites = sprites, merge_paths = merge_paths, renderer = mapbox.renderer_version)
+    
+    return {'css': css, 'sprites': sprites, 'parent_zoom': parent_zoom}, body
+
+def upgrade_mapbox_tiles(styles, mapbox_style, mapbox_key, tiles, tile_timeout, merge_paths):
+    # 상위 타일로 대신한 타일을 백그라운드에서 받아서 캐시에 저장, 다음 렌더링부터 사용
+    tile_store = tile_cache.open_tile_store(cache_dir, mbtiles = cache_mbtiles, max_bytes = cache_max_bytes, ttl = cache_ttl, prune_interval = cache_prune_interval)
+    
+    try:
+        with requests.Session() as session:
+            for x, y, level, clip_rect in tiles:
+                try:
+                    render_mapbox_tile(styles, mapbox_style, mapbox_key, x, y, level, tile_store, session, tile_timeout, clip_rect = clip_rect, merge_paths = merge_paths)
+                except (mapbox.MapBoxError, requests.exceptions.RequestException):
+                    continue
+    finally:
+        tile_store.close()
+
+def load_mapbox_tiles(tile_store, mapframe, mapbox_key, mapbox_style, level, tile_range, tile_pos, tile_size, max_workers, tile_timeout, render_in_processes, clip_to_mapframe, merge_paths, overzoom, upgrade_in_background):
+    # 타일별 (헤더, 본문)을 캐시에서 읽고, 없는 타일은 받아서 렌더링
+    tile_x1, tile_y1, tile_x2, tile_y2 = tile_range
+    pos_x1, pos_y1 = tile_pos
+    tiles = {}
+    clip_rects = {}
+    
+    # 스타일은 style_ttl 동안 메모리/파일 캐시에서 읽으므로, 수정된 스타일도 재검증 주기 안에 반영됨
+    styles = mapbox.load_style(mapbox_style, mapbox_key, cache_dir = cache_dir)
+    revision = mapbox.get_style_revision(styles)
+    
+    for x in range(tile_x1, tile_x2 + 1):
+        for y in range(tile_y1, tile_y2 + 1):
+            pos_x = pos_x1 + (x - tile_x1) * tile_size
+            pos_y = pos_y1 + (y - tile_y1) * tile_size
+            
+            # 가장자리 타일은 영역 밖 도형을 잘라내고 잘린 영역별로 캐시
+            clip_rect = get_tile_clip_rect(mapframe, pos_x, pos_y, tile_size) if clip_to_mapframe else None
+            
+            clip_rects[(x, y)] = clip_rect
+            tile = tile_store.get_fragment(mapbox_style, x, y, level, clip_rect, merge_paths = merge_paths)
+            
+            # 다른 리비전의 스타일이나 다른 버전의 렌더러로 렌더링한 조각은 캐시에 없는 것으로 취급하고 다시 렌더링
+            if tile != None and not is_fragment_current(tile[0], revision):
+                tile = None
+            
+            tiles[(x, y)] = tile
+    
+    missing_tiles = [tile_xy for tile_xy, tile in tiles.items() if tile == None]
+    
+    if missing_tiles:
+        # 캐시에 없는 타일은 공유 세션으로 동시에 받아서 렌더링
+        workers = max(1, min(max_workers, len(missing_tiles)))
+        render_executor = None
+        
+        if render_in_processes:
+            # 디코딩과 렌더링은 CPU 작업이므로 모든 코어의 프로세스에서 처리
+            processes = min(os.cpu_count() or 1, len(missing_tiles))
+            render_executor = concurrent.futures.ProcessPoolExecutor(max_workers = processes, initializer = mapbox.init_render_worker, initargs = (styles,))
+        
+        with requests.Session() as session:
+            session.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize = workers))
+            
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers = workers)
+            try:
+                futures = {}
+                for x, y in missing_tiles:
+                    futures[(x, y)] = executor.submit(render_mapbox_tile, styles, mapbox_style, mapbox_key, x, y, level, tile_store, session, tile_timeout, render_executor, clip_rects[(x, y)], merge_paths, overzoom = overzoom, prefer_cache = upgrade_in_background)
+                
+                for tile_xy, future in futures.items():
+                    tiles[tile_xy] = future.result()
+            finally:
+                executor.shutdown(cancel_futures = True)
+                if render_executor:
+                    render_executor.shutdown(cancel_futures = True)
+        
+        # 새 타일을 저장했으므로 용량 한도를 넘은 캐시 정리
+        tile_store.prune_if_needed()
+        
+        upgrade_tiles = [(x, y, level, clip_rects[(x, y)]) for (x, y), (header, body) in tiles.items() if header.get('parent_zoom') != None]
+        
+        if upgrade_in_background and upgrade_tiles:
+            thread = threading.Thread(target = upgrade_mapbox_tiles, args = (styles, mapbox_style, mapbox_key, upgrade_tiles, tile_timeout, merge_paths), daemon = True)
+            thread.start()
+    
+    return tiles
+
+def read_seed_manifest(manifest_filename):
+    try:
+        with open(manifest_filename, mode='r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_seed_manifest(manifest_filename, manifest):
+    with tile_cache.atomic_write(manifest_filename) as f:
+        json.dump(manifest, f)
+
+def seed_mapbox_tiles(mapbox_key, mapbox_style, bbox, min_level = 11, max_level = 14, max_workers = 8, tile_timeout = 20, refresh = False, manifest_filename = None, progress = None):
+    # bbox 범위의 타일을 미리 받아서 원본 MVT와 잘리지 않은 타일 조각을 캐시에 저장
+    # 진행 상황은 manifest 파일에 기록하므로 중단된 뒤 다시 실행하면 이어서 진행
+    # refresh이면 캐시에 있는 타일도 새로 받음
+    tiles = []
+    for level in range(min_level, max_level + 1):
+        tile_x1, tile_y1 = mapbox.deg2num(bbox[3], bbox[0], level)
+        tile_x2, tile_y2 = mapbox.deg2num(bbox[1], bbox[2], level)
+        
+        for x in range(tile_x1, tile_x2 + 1):
+            for y in range(tile_y1, tile_y2 + 1):
+                tiles.append((x, y, level))
+    
+    if manifest_filename == None:
+        manifest_filename = cache_dir + '/seed-{}.json'.format(mapbox_style.replace("/", "_"))
+    
+    manifest = read_seed_manifest(manifest_filename)
+    if manifest == None or manifest['finished'] or manifest['style'] != mapbox_style or manifest['bbox'] != list(bbox) or manifest['levels'] != [min_level, max_level] or manifest['refresh'] != refresh:
+        manifest = {'style': mapbox_style, 'bbox': list(bbox), 'levels': [min_level, max_level], 'refresh': refresh, 'started': time.time(), 'finished': False, 'done': []}
+    
+    done = set(tuple(tile) for tile in manifest['done'])
+    remaining = [tile for tile in tiles if not tile in done]
+    failed = []
+    
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    
+    styles = mapbox.load_style(mapbox_style, mapbox_key, cache_dir = cache_dir, refresh = refresh)
+    tile_store = tile_cache.open_tile_store(cache_dir, mbtiles = cache_mbtiles)
+    
+    revision = mapbox.get_style_revision(styles)
+    source = mapbox.get_tile_source(styles)
+    
+    def seed_tile(x, y, level):
+        # 미리 받은 타일은 고정해서 렌더링 후 캐시 정리에서 용량 한도로 삭제되지 않도록 함
+        fragment = tile_store.get_fragment(mapbox_style, x, y, level, merge_paths = True)
+        if refresh or fragment == None or not is_fragment_current(fragment[0], revision):
+            render_mapbox_tile(styles, mapbox_style, mapbox_key, x, y, level, tile_store, session, tile_timeout, refresh = refresh)
+        tile_store.pin(source, mapbox_style, x, y, level)
+    
+    try:
+        with requests.Session() as session:
+            session.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize = max_workers))
+            
+            with concurrent.futures.ThreadPoolExecutor(max_workers = max_workers) as executor:
+                # 한 번에 max_workers의 두 배까지만 제출해서 중단 시 버려지는 작업을 줄임
+                pending = {}
+                tile_iter = iter(remaining)
+                
+                while True:
+                    for tile in tile_iter:
+                        pending[executor.submit(seed_tile, *tile)] = tile
+                        if len(pending) >= max_workers * 2:
+                            break
+                    
+                    if not pending:
+                        break
+                    
+                    completed, not_completed = concurrent.futures.wait(pending, return_when = concurrent.futures.FIRST_COMPLETED)
+                    
+                    for future in completed:
+                        tile = pending.pop(future)
+                        
+                        try:
+                            future.result()
+                            done.add(tile)
+                        except (mapbox.MapBoxError, requests.exceptions.RequestException) as e:
+                            failed.append((tile, e))
+                        
+                        if len(done) % 50 == 0:
+                            tile_store.flush()
+                            manifest['done'] = [list(tile) for tile in done]
+                            write_seed_manifest(manifest_filename, manifest)
+                    
+                    if progress:
+                        progress(len(done), len(tiles), len(failed))
+        
+        manifest['finished'] = not failed
+    finally:
+        tile_store.close()
+        manifest['done'] = [list(tile) for tile in done]
+        write_seed_manifest(manifest_filename, manifest)
+    
+    return len(done), len(tiles), failed
+
+def get_stitched_mapbox_map(mapframe, mapbox_key, mapbox_style, level, tile_range, tile_pos, tile_size, max_workers, tile_timeout, clip_to_mapframe, fp, overzoom):
+    tile_x1, tile_y1, tile_x2, tile_y2 = tile_range
+    pos_x1, pos_y1 = tile_pos
+    styles = mapbox.load_style(mapbox_style, mapbox_key, cache_dir = cache_dir)
+    # 스타일에서 그리는 소스 레이어만 디코딩
+    source_layers = mapbox.get_render_plan(styles, level)['source_layers']
+    tiles = {}
+    clip_rects = {}
+    
+    tile_store = tile_cache.open_tile_store(cache_dir, mbtiles = cache_mbtiles, max_bytes = cache_max_bytes, ttl = cache_ttl, prune_interval = cache_prune_interval)
+    try:
+        workers = max(1, min(max_workers, (tile_x2 - tile_x1 + 1) * (tile_y2 - tile_y1 + 1)))
+        
+        with requests.Session() as session:
+            session.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize = workers))
+            
+            with concurrent.futures.ThreadPoolExecutor(max_workers = workers) as executor:
+                futures = {}
+                for x in range(tile_x1, tile_x2 + 1):
+                    for y in range(tile_y1, tile_y2 + 1):
+                        pos_x = pos_x1 + (x - tile_x1) * tile_size
+                        pos_y = pos_y1 + (y - tile_y1) * tile_size
+                        
+                        clip_rects[(x, y)] = get_tile_clip_rect(mapframe, pos_x, pos_y, tile_size) if clip_to_mapframe else None
+                        futures[(x, y)] = executor.submit(fetch_mapbox_tile, styles, mapbox_key, x, y, level, tile_store, session, tile_timeout, overzoom = overzoom)
+                
+                for (x, y), future in futures.items():
+                    data, parent_zoom = future.result()
+                    tiles[(x, y)] = mapbox.decode_tile(data, x, y, level, parent_zoom, source_layers)
+        
+        tile_store.prune_if_needed()
+    finally:
+        tile_store.close()
+    
+    stylesheet = mapbox.StyleSheet()
+    body = mapbox.render_tiles(styles, tiles, level, tile_range, clip_rects = clip_rects, stylesheet = stylesheet, vectorize = vectorize_filters)
+    
+    if fp == None:
+        output = io.StringIO()
+    else:
+        output = fp
+    
+    output.write('<g id="background-map" xmlns:xlink="http://www.w3.org/1999/xlink">\n')
+    output.write('<style>\n{}</style>\n'.format(stylesheet.css()))
+    if stylesheet.sprites:
+        output.write('<defs>\n{}</defs>\n'.format(stylesheet.defs()))
+    output.write('<g id="tiles-z{0}" transform="translate({1}, {2}) scale({3}, {3}) ">\n'.format(level, pos_x1, pos_y1, tile_size / 4096))
+    output.write(body)
+    output.write('</g>\n')
+    output.write('</g>\n')
+    
+    if fp == None:
+        return output.getvalue()
+
+def get_mapbox_map(mapframe, mapbox_key, mapbox_style, max_workers = 8, tile_timeout = 20, render_in_processes = False, clip_to_mapframe = True, merge_paths = True, fp = None, overzoom = True, upgrade_in_background = False, stitch_tiles = False):
+    # overzoom: 받지 못한 타일은 캐시에 있는 상위 타일(최대 2단계)로 대신 렌더링
+    # upgrade_in_background: 상위 타일이 있으면 기다리지 않고 바로 사용하고, 정확한 타일은 백그라운드에서 받음
+    # stitch_tiles: 타일별 조각 대신 모든 타일을 이어 붙인 하나의 지도로 렌더링 (조각 캐시는 사용하지 않음)
     route_size_max = max(mapframe.size())
     level = 11
     
@@ -577,52 +1126,45 @@ def get_mapbox_map(mapframe, mapbox_key, mapbox_style):
     gps_pos = convert_gps((mapframe.right, mapframe.bottom))
     tile_x2, tile_y2 = mapbox.deg2num(gps_pos[1], gps_pos[0], level)
     
-    result = '<g id="background-map">\n'
-    
     tile_pos = mapbox.num2deg(tile_x1, tile_y1, level)
     pos_x1, pos_y1 = convert_pos((tile_pos[1], tile_pos[0]))
     
-    style_cache_dir = cache_dir + '/' + mapbox_style.replace("/", "_")
-    if not os.path.exists(style_cache_dir):
-        os.makedirs(style_cache_dir)
+    if stitch_tiles:
+        return get_stitched_mapbox_map(mapframe, mapbox_key, mapbox_style, level, (tile_x1, tile_y1, tile_x2, tile_y2), (pos_x1, pos_y1), tile_size, max_workers, tile_timeout, clip_to_mapframe, fp, overzoom)
+    
+    tile_store = tile_cache.open_tile_store(cache_dir, mbtiles = cache_mbtiles, max_bytes = cache_max_bytes, ttl = cache_ttl, prune_interval = cache_prune_interval)
+    try:
+        tiles = load_mapbox_tiles(tile_store, mapframe, mapbox_key, mapbox_style, level, (tile_x1, tile_y1, tile_x2, tile_y2), (pos_x1, pos_y1), tile_size, max_workers, tile_timeout, render_in_processes, clip_to_mapframe, merge_paths, overzoom, upgrade_in_background)
+    finally:
+        tile_store.close()
+    
+    # 모든 타일의 CSS 클래스를 하나의 <style> 블록으로 합침
+    stylesheet = mapbox.StyleSheet()
+    for header, body in tiles.values():
+        stylesheet.update(header['css'])
+        stylesheet.sprites.update(header.get('sprites', []))
+    
+    # fp가 주어지면 타일 본문을 그대로 출력 스트림에 씀
+    if fp == None:
+        output = io.StringIO()
+    else:
+        output = fp
+    
+    output.write('<g id="background-map" xmlns:xlink="http://www.w3.org/1999/xlink">\n')
+    output.write('<style>\n{}</style>\n'.format(stylesheet.css()))
+    if stylesheet.sprites:
+        output.write('<defs>\n{}</defs>\n'.format(stylesheet.defs()))
     
     for x in range(tile_x1, tile_x2 + 1):
         for y in range(tile_y1, tile_y2 + 1):
-            cache_filename = style_cache_dir + '/tile{}-{}-z{}.svg'.format(x, y, level)
-            cache_valid = False
-            tile = None
-            rx_svg = re.compile(r'<svg\s.*?>(.*)</svg>', flags = re.DOTALL)
-            
             pos_x = pos_x1 + (x - tile_x1) * tile_size
             pos_y = pos_y1 + (y - tile_y1) * tile_size
-
-            if os.path.exists(cache_filename):
-                with open(cache_filename, mode='r', encoding='utf-8') as f:
-                    text = f.read()
-                    svg_match = rx_svg.search(text)
-                    
-                    if svg_match:
-                        cache_valid = True
-                        tile = svg_match[1]
-            
-            if not cache_valid:
-                try:
-                    cache_io = io.StringIO()
-                    mapbox.load_tile(mapbox_style, mapbox_key, x, y, level, draw_full_svg = True, clip_mask = True, fp = cache_io)
-                    
-                    text = cache_io.getvalue()
-                    tile = rx_svg.search(text)[1]
-
-                    with open(cache_filename, mode='w+', encoding='utf-8') as cache_file:
-                        cache_file.write(text)
-                except:
-                    os.remove(cache_filename)
-                    raise
             
-            result += '<g id="tile{0}-{1}-z{2}" transform="translate({3}, {4}) scale({5}, {5}) ">\n'.format(x, y, level, pos_x, pos_y, tile_size / 4096)
-            result += tile
-            result += '</g>\n'
+            output.write('<g id="tile{0}-{1}-z{2}" transform="translate({3}, {4}) scale({5}, {5}) ">\n'.format(x, y, level, pos_x, pos_y, tile_size / 4096))
+            output.write(tiles[(x, y)][1])
+            output.write('</g>\n')
             
-    result += '</g>\n'
+    output.write('</g>\n')
     
-    return result
\ No newline at end of file
+    if fp == None:
+        return output.getvalue()
@@ -1,4 +1,4 @@
-import os, sys, json, requests, threading, shutil
+import os, sys, json, requests, threading, shutil, multiprocessing
 from PySide6.QtWidgets import QApplication, QMainWindow, QLabel, QLineEdit, QHBoxLayout, QVBoxLayout, QWidget, QTableWidget, QTableWidgetItem, QAbstractItemView, QPushButton, QGroupBox, QRadioButton, QSpacerItem, QCheckBox, QProgressBar, QMessageBox, QGridLayout, QSlider, QDialog, QComboBox
 from PySide6.QtSvg import QSvgRenderer
 from PySide6.QtSvgWidgets import QSvgWidget
@@ -33,19 +33,26 @@ class RoundedComboBox(QComboBox):
 
 class BusInfoThread(QObject):
     thread_finished = Signal(str)
+    # 지역별 검색이 끝날 때마다 지금까지의 결과를 전달
+    partial_result = Signal(str)
     
     def __init__(self, parent):
         super(BusInfoThread, self).__init__(parent)
         self.widget = parent
         
     def run(self):
-        bus_info_list, error = bus_api.search_bus_info(self.widget.key, self.widget.search_input.text(), return_error = True)
+        bus_info_list, error = bus_api.search_bus_info(self.widget.key, self.widget.search_input.text(), return_error = True, callback = self.emit_partial_result)
+        
+        self.thread_finished.emit(self.result_to_json(bus_info_list, error))
+    
+    def emit_partial_result(self, bus_info_list, error):
+        self.partial_result.emit(self.result_to_json(bus_info_list, error))
+    
+    def result_to_json(self, bus_info_list, error):
         error_str = None
         if error:
             error_str = str(error)
-        result_json = json.dumps({'result': bus_info_list, 'error': error_str})
-        
-        self.thread_finished.emit(result_json)
+        return json.dumps({'result': bus_info_list, 'error': error_str})
 
 class BusRouteThread(QObject):
     thread_finished = Signal(str)
@@ -62,24 +69,13 @@ class BusRouteThread(QObject):
         bus_stops = None
         
         try:
-            if route_data['type'] <= 10:
-                route_positions = bus_api.get_seoul_bus_route(self.widget.key, route_data['id'])
-                route_info = bus_api.get_seoul_bus_type(self.widget.key, route_data['id'])
-                bus_stops = bus_api.get_seoul_bus_stops(self.widget.key, route_data['id'])
-            elif route_data['type'] <= 60:
-                route_positions = bus_api.get_gyeonggi_bus_route(self.widget.key, route_data['id'])
-                route_info = bus_api.get_gyeonggi_bus_type(self.widget.key, route_data['id'])
-                bus_stops = bus_api.get_gyeonggi_bus_stops(self.widget.key, route_data['id'])
-            else:
-                route_positions, route_bims_id = bus_api.get_busan_bus_route(route_data['name'])
-                route_info = bus_api.get_busan_bus_type(self.widget.key, route_bims_id)
-                bus_stops = bus_api.get_busan_bus_stops(self.widget.key, route_data['id'], route_bims_id)
+            route_positions, route_info, bus_stops = bus_api.fetch_route_bundle(self.widget.key, bus_api.convert_type_to_region_id(route_data['type']), route_data['id'], route_data['name'])
         except requests.exceptions.ConnectTimeout:
             error = "[오류] Connection Timeout"
         except Exception as e:
             error = "[오류] " + str(e)
         
-        result_json = json.dumps({'result': {'route_positions': route_positions, 'route_info': route_info, 'bus_stops': bus_stops}, 'error': error})
+        result_json = json.dumps({'result': {'route_positions': route_positions, 'route_info': route_info, 'bus_stops': bus_stops}, 'error': error}, default = bus_api.json_default)
         self.thread_finished.emit(result_json)
 
 class OkDialog(QDialog):
@@ -774,6 +770,7 @@ class MainWindow(QMainWindow):
         self.bus_route_thread = BusRouteThread(self)
         
         self.bus_info_thread.thread_finished.connect(self.bus_info_finished)
+        self.bus_info_thread.partial_result.connect(self.bus_info_partial)
         self.bus_route_thread.thread_finished.connect(self.bus_route_finished)
         
         self.setWindowTitle("버스 노선도 생성기 GUI")
@@ -897,10 +894,17 @@ class MainWindow(QMainWindow):
         t.daemon = True
         t.start()
     
+    @Slot(str)
+    def bus_info_partial(self, result_json):
+        # 먼저 응답한 지역의 결과부터 표시, 검색창은 모든 지역이 끝난 뒤 다시 활성화
+        self.show_bus_info(json.loads(result_json))
+    
     @Slot(str)
     def bus_info_finished(self, result_json):
-        result = json.loads(result_json)
-        
+        self.show_bus_info(json.loads(result_json))
+        self.search_input.setEnabled(True)
+    
+    def show_bus_info(self, result):
         self.bus_info_list = result['result']
         
         if len(self.bus_info_list) < 1: 
@@ -923,8 +927,6 @@ class MainWindow(QMainWindow):
             self.result_table.setItem(i, 1, item_type)
             self.result_table.setItem(i, 2, item_name)
             self.result_table.setItem(i, 3, item_desc)
-            
-        self.search_input.setEnabled(True)
     
     def draw_route_preview(self, item):
         self.result_table.setEnabled(False)
@@ -1038,6 +1040,7 @@ class MainWindow(QMainWindow):
         self.render_preview_routemap()
     
 if __name__ == '__main__':
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     app.setStyleSheet("""
         QLineEdit { padding: 3px; border: 1px solid rgba(0, 0, 0, 10%); background-color: #fff; border-radius: 4px }
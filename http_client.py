@@ -0,0 +1,73 @@
+import random, threading, time
+import requests
+
+# 모든 API 요청이 공유하는 HTTP 세션: 호스트별 연결 풀과 keep-alive
+pool_connections = 8
+pool_maxsize = 16
+
+# 기본 제한 시간 (연결, 응답) 초, 호출하는 쪽에서 지정하지 않으면 사용
+default_timeout = (5, 20)
+
+# 5xx 응답이나 공공데이터포털 503 페이지를 받으면 지수 백오프로 재시도
+max_retries = 4
+backoff_base = 0.5
+backoff_max = 8
+
+# apis.data.go.kr는 과부하 시 상태 코드 200으로 이 페이지를 돌려줌
+unavailable_page = b'apis.data.go.kr/503.html'
+
+session = None
+session_lock = threading.Lock()
+
+def get_session():
+    global session
+    
+    with session_lock:
+        if session == None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections = pool_connections, pool_maxsize = pool_maxsize)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        
+        return session
+
+def is_unavailable(response, stream = False):
+    # stream이면 본문을 다 읽지 않도록 HTML 응답일 때만 본문에서 503 페이지를 확인
+    if response.status_code >= 500:
+        return True
+    
+    if stream and not response.headers.get('Content-Type', '').startswith('text/html'):
+        return False
+    
+    return unavailable_page in response.content
+
+def get_backoff(attempt):
+    # 대기 시간의 절반은 고정, 나머지 절반은 무작위로 해서 동시에 재시도하지 않도록 함
+    delay = min(backoff_max, backoff_base * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def get(url, params = None, timeout = None, headers = None, session = None, deadline = None, stream = False):
+    # 재시도해도 실패하면 마지막 응답을 그대로 반환, 응답 내용의 오류 처리는 호출한 쪽에서 함
+    # deadline(time.time() 기준)이 주어지면 그 시각을 넘겨서 재시도하지 않음
+    # stream이면 본문을 받지 않은 응답을 반환하므로 호출한 쪽에서 iter_content로 읽고 닫아야 함
+    if session == None:
+        session = get_session()
+    
+    if timeout == None:
+        timeout = default_timeout
+    
+    attempt = 0
+    
+    while True:
+        response = session.get(url, params = params, timeout = timeout, headers = headers, stream = stream)
+        
+        if not is_unavailable(response, stream) or attempt >= max_retries:
+            return response
+        
+        delay = get_backoff(attempt)
+        if deadline != None and time.time() + delay >= deadline:
+            return response
+        
+        response.close()
+        time.sleep(delay)
+        attempt += 1
@@ -1,17 +1,120 @@
-import math, requests, json, re, io, colorsys, sys, os
+import math, requests, json, re, io, colorsys, sys, os, operator, bisect, time, hashlib, tempfile
+import xml.etree.ElementTree as elemtree
 import mapbox_vector_tile
+import http_client
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 tile_url = 'https://api.mapbox.com/v4/{}/{}/{}/{}.mvt'
 style_url = 'https://api.mapbox.com/styles/v1/{}'
-properties = {}
 
 sprite_cache = {}
+color_cache = {}
+style_cache = {}
+compiled_style_cache = {}
+render_plan_cache = {}
+
+# 프로세스 풀 작업자가 사용하는 스타일
+worker_styles = None
+
+# 스타일 JSON 재검증 주기 (초)
+style_ttl = 24 * 60 * 60
+
+# 렌더링 결과가 달라지는 수정을 하면 올림, 다른 버전으로 렌더링해서 캐시된 조각은 다시 렌더링
+renderer_version = 1
+
+# 색상 값으로 변환해야 하는 속성
+color_properties = {'background-color', 'fill-color', 'line-color', 'text-color', 'text-halo-color'}
+# 표현식으로 해석하지 않는 속성
+raw_properties = {'text-font', 'line-dasharray'}
+
+# 표현식이 의존하는 값: 상수, 줌, 피처 속성
+depends_none = 0
+depends_zoom = 1
+depends_feature = 2
 
 class MapBoxError(Exception):
     pass
 
+class StyleSheet():
+    # 같은 스타일의 도형은 하나의 CSS 클래스를 공유
+    # 사용한 스프라이트도 모아두고 문서마다 <symbol>로 한 번만 출력
+    def __init__(self):
+        self.classes = {}
+        self.rules = {}
+        self.sprites = set()
+    
+    def get_class(self, style):
+        style_str = css_style(style)
+        
+        if style_str not in self.classes:
+            # 타일마다 따로 렌더링해도 같은 이름이 나오도록 스타일 문자열로 이름을 생성
+            class_name = 'm' + hashlib.md5(style_str.encode('utf-8')).hexdigest()[:8]
+            self.classes[style_str] = class_name
+            self.rules[class_name] = style_str
+        
+        return self.classes[style_str]
+    
+    def update(self, css):
+        for rule in css.splitlines():
+            match = re.match(r'\.([0-9a-z]+)\{(.*)\}$', rule)
+            if match:
+                self.classes[match[2]] = match[1]
+                self.rules[match[1]] = match[2]
+    
+    def css(self):
+        return ''.join('.{}{{{}}}\n'.format(class_name, style_str) for class_name, style_str in sorted(self.rules.items()))
+    
+    def get_sprite_id(self, sprite_id):
+        self.sprites.add(sprite_id)
+        return get_sprite_symbol_id(sprite_id)
+    
+    def defs(self):
+        result = ''
+        
+        for sprite_id in sorted(self.sprites):
+            sprite = load_sprite(sprite_id)
+            result += '<symbol id="{}" viewBox="0 0 {} {}">{}</symbol>\n'.format(get_sprite_symbol_id(sprite_id), sprite['size'][0], sprite['size'][1], sprite['image'])
+        
+        return result
+
+class TileRenderContext():
+    # 렌더링 중인 타일 정보, 표현식 평가 시 명시적으로 전달
+    def __init__(self, x, y, zoom, clip_rect = None, stylesheet = None, merge_paths = False):
+        self.x = x
+        self.y = y
+        self.zoom = zoom
+        # 타일 좌표계의 (x1, y1, x2, y2), 이 영역 밖의 도형은 잘라냄
+        self.clip_rect = clip_rect
+        self.stylesheet = stylesheet if stylesheet else StyleSheet()
+        # merge_paths이면 같은 스타일의 연속된 도형을 하나의 <path>로 합쳐서 출력
+        self.merge_paths = merge_paths
+        self.path_class = None
+        self.path_data = []
+        self.path_pen = (0, 0)
+    
+    def add_path(self, f, style_class, lines, closed):
+        if style_class != self.path_class:
+            self.flush_path(f)
+            self.path_class = style_class
+        
+        path_data, self.path_pen = encode_path(lines, closed, self.path_pen)
+        self.path_data.append(path_data)
+    
+    def flush_path(self, f):
+        # 그리기 순서를 지키기 위해 스타일이 바뀌거나 레이어가 끝날 때마다 출력
+        if any(self.path_data):
+            f.write('<path d="{}" class="{}" />\n'.format(''.join(self.path_data), self.path_class))
+        
+        self.path_class = None
+        self.path_data = []
+        self.path_pen = (0, 0)
+
 def check_token_valid(token):
-    response = requests.get(style_url.format(''), params = {'access_token': token})
+    response = http_client.get(style_url.format(''), params = {'access_token': token})
     if response.status_code == 401:
         return False
     else:
@@ -48,12 +151,12 @@ def css_style(style):
 def rgb_to_hex(rgb):
     return '#{:02x}{:02x}{:02x}'.format(int(rgb[0] * 255), int(rgb[1] * 255), int(rgb[2] * 255))
 
-def color_to_rgb(color):
-    rx_hsl = re.compile(r'hsl\(\s*(\d+),\s*(\d+)%,\s*(\d+)%\s*\)')
-    rx_hsla = re.compile(r'hsla\(\s*(\d+),\s*(\d+)%,\s*(\d+)%\s*,\s*[0-9.]+\)')
-    rx_rgb = re.compile(r'rgb\(\s*(\d+),\s*(\d+),\s*(\d+)\s*\)')
-    rx_hex = re.compile(r'#([0-9a-fA-F]{3}|[0-9a-fA-F]{6})$')
-    
+rx_hsl = re.compile(r'hsl\(\s*(\d+),\s*(\d+)%,\s*(\d+)%\s*\)')
+rx_hsla = re.compile(r'hsla\(\s*(\d+),\s*(\d+)%,\s*(\d+)%\s*,\s*[0-9.]+\)')
+rx_rgb = re.compile(r'rgb\(\s*(\d+),\s*(\d+),\s*(\d+)\s*\)')
+rx_hex = re.compile(r'#([0-9a-fA-F]{3}|[0-9a-fA-F]{6})$')
+
+def parse_color(color):
     hsl_match = rx_hsl.match(color)
     if hsl_match:
         return colorsys.hls_to_rgb(int(hsl_match[1])/360, int(hsl_match[3])/100, int(hsl_match[2])/100)
@@ -75,319 +178,1387 @@ def color_to_rgb(color):
     
     raise ValueError('Unknown Color: "{}"'.format(color))
 
+def color_to_rgb(color):
+    # 스타일에 나오는 색상 문자열은 종류가 적으므로 한 번만 해석
+    rgb = color_cache.get(color)
+    
+    if rgb == None:
+        rgb = parse_color(color)
+        color_cache[color] = rgb
+    
+    return rgb
+
 def color_to_hex(color):
     return rgb_to_hex(color_to_rgb(color))
 
-def interpolate_color(expression, method, input_value, feature):
-    if len(expression) % 2 != 0:
+def cubic_bezier(x1, y1, x2, y2):
+    # x(t)를 뉴턴 방법으로 풀고, 수렴하지 않으면 이분법 사용
+    cx = 3 * x1
+    bx = 3 * (x2 - x1) - cx
+    ax = 1 - cx - bx
+    cy = 3 * y1
+    by = 3 * (y2 - y1) - cy
+    ay = 1 - cy - by
+    
+    def solve(x):
+        t = x
+        for i in range(8):
+            error = ((ax * t + bx) * t + cx) * t - x
+            if abs(error) < 1e-6:
+                return ((ay * t + by) * t + cy) * t
+            
+            derivative = (3 * ax * t + 2 * bx) * t + cx
+            if abs(derivative) < 1e-6:
+                break
+            t -= error / derivative
+        
+        low = 0.0
+        high = 1.0
+        t = x
+        while low < high:
+            error = ((ax * t + bx) * t + cx) * t - x
+            if abs(error) < 1e-6:
+                break
+            if error < 0:
+                low = t
+            else:
+                high = t
+            t = (low + high) / 2
+            if high - low < 1e-9:
+                break
+        
+        return ((ay * t + by) * t + cy) * t
+    
+    return solve
+
+def get_interpolation_factor(method):
+    # 구간 [lower, upper]에서 value의 보간 비율(0~1)을 구하는 함수
+    if method[0] == 'linear' or (method[0] == 'exponential' and method[1] == 1):
+        return lambda value, lower, upper: (value - lower) / (upper - lower)
+    elif method[0] == 'exponential':
+        base = method[1]
+        return lambda value, lower, upper: (base ** (value - lower) - 1) / (base ** (upper - lower) - 1)
+    elif method[0] == 'cubic-bezier':
+        solve = cubic_bezier(*method[1:5])
+        return lambda value, lower, upper: solve((value - lower) / (upper - lower))
+    else:
+        raise ValueError('Unknown Interpolation: "{}"'.format(method[0]))
+
+def interpolate_value(left, right, t):
+    # 숫자, 숫자 배열, RGB 튜플은 항목별로 보간
+    if isinstance(left, tuple) or isinstance(left, list):
+        return type(left)(l + (r - l) * t for l, r in zip(left, right))
+    
+    return left + (right - left) * t
+
+def interpolate_output(left, right, t):
+    # 색상 문자열은 RGB로 보간해서 다시 색상 문자열로 반환
+    if isinstance(left, str):
+        return rgb_to_hex(interpolate_value(color_to_rgb(left), color_to_rgb(right), t))
+    
+    return interpolate_value(left, right, t)
+
+def constant_function(value):
+    return lambda feature, context: value
+
+def compile_binary(func):
+    def compiler(values):
+        left, left_depends = compile_node(values[0])
+        right, right_depends = compile_node(values[1])
+        
+        if right_depends == depends_none:
+            right_value = right(None, None)
+            return (lambda feature, context: func(left(feature, context), right_value)), left_depends
+        
+        return (lambda feature, context: func(left(feature, context), right(feature, context))), max(left_depends, right_depends)
+    
+    return compiler
+
+def compile_not(values):
+    value, depends = compile_node(values[0])
+    return (lambda feature, context: not value(feature, context)), depends
+
+def compile_sqrt(values):
+    value, depends = compile_node(values[0])
+    return (lambda feature, context: math.sqrt(value(feature, context))), depends
+
+def compile_zoom(values):
+    return (lambda feature, context: context.zoom), depends_zoom
+
+def compile_all(values):
+    nodes = [compile_node(value) for value in values]
+    functions = tuple(node[0] for node in nodes)
+    
+    def evaluate(feature, context):
+        for function in functions:
+            if not function(feature, context):
+                return False
+        return True
+    
+    return evaluate, max((node[1] for node in nodes), default = depends_none)
+
+def compile_any(values):
+    nodes = [compile_node(value) for value in values]
+    functions = tuple(node[0] for node in nodes)
+    
+    def evaluate(feature, context):
+        for function in functions:
+            if function(feature, context):
+                return True
+        return False
+    
+    return evaluate, max((node[1] for node in nodes), default = depends_none)
+
+def compile_at(values):
+    if len(values) != 2:
+        raise ValueError()
+    
+    index, index_depends = compile_node(values[0])
+    array, array_depends = compile_node(values[1])
+    
+    return (lambda feature, context: array(feature, context)[index(feature, context)]), max(index_depends, array_depends)
+
+def compile_get(values):
+    name = values[0]
+    return (lambda feature, context: feature['properties'].get(name, 0)), depends_feature
+
+def compile_has(values):
+    if len(values) != 1:
         raise ValueError()
     
-    color_list = []
-    value_list = []
+    name = values[0]
+    return (lambda feature, context: name in feature['properties']), depends_feature
+
+def compile_literal(values):
+    return constant_function(values[0]), depends_none
+
+def compile_to_number(values):
+    value, depends = compile_node(values[0])
+    return (lambda feature, context: int(value(feature, context))), depends
+
+def compile_to_string(values):
+    value, depends = compile_node(values[0])
+    return (lambda feature, context: str(value(feature, context))), depends
+
+def compile_match(values):
+    label, label_depends = compile_node(values[0])
+    default, default_depends = compile_node(values[-1])
+    
+    # 라벨 -> 출력값 조회 테이블 (먼저 나온 라벨이 우선)
+    table = {}
+    outputs_depends = default_depends
+    
+    for i in range(1, len(values) - 1, 2):
+        output, output_depends = compile_node(values[i + 1])
+        outputs_depends = max(outputs_depends, output_depends)
+        
+        labels = values[i] if isinstance(values[i], list) else [values[i]]
+        for key in labels:
+            if key not in table:
+                table[key] = output
+    
+    depends = max(label_depends, outputs_depends)
+    
+    if outputs_depends == depends_none:
+        table = {key: output(None, None) for key, output in table.items()}
+        default_value = default(None, None)
+        
+        # 필터에서 주로 사용되는 형태: ['match', input, [...], true, false]
+        if default_value is False and all(value is True for value in table.values()):
+            label_set = frozenset(table)
+            return (lambda feature, context: label(feature, context) in label_set), depends
+        
+        lookup = table.get
+        return (lambda feature, context: lookup(label(feature, context), default_value)), depends
+    
+    lookup = table.get
+    return (lambda feature, context: lookup(label(feature, context), default)(feature, context)), depends
+
+def compile_case(values):
+    nodes = [(compile_node(values[i]), compile_node(values[i + 1])) for i in range(0, len(values) - 1, 2)]
+    branches = tuple((condition[0], output[0]) for condition, output in nodes)
+    default, default_depends = compile_node(values[-1])
     
-    for i in range(0, len(expression), 2):
-        color_list.append(expression[i+1])
-        value_list.append(expression[i])
+    def evaluate(feature, context):
+        for condition, output in branches:
+            if condition(feature, context):
+                return output(feature, context)
+        return default(feature, context)
     
-    rgbs = []
-    result = None
+    return evaluate, max([default_depends] + [max(condition[1], output[1]) for condition, output in nodes])
+
+def compile_coalesce(values):
+    nodes = [compile_node(value) for value in values]
+    functions = tuple(node[0] for node in nodes)
     
-    for color in color_list:
-        rgbs.append(color_to_rgb(color))
+    def evaluate(feature, context):
+        for function in functions:
+            value = function(feature, context)
+            if value:
+                return value
+        return functions[-1](feature, context)
     
-    for i in range(len(value_list)):
-        if input_value < value_list[i]:
-            return rgb_to_hex(rgbs[i])
+    return evaluate, max(node[1] for node in nodes)
+
+def compile_step(values):
+    label, label_depends = compile_node(values[0])
+    stops = [values[i] for i in range(2, len(values) - 1, 2)]
+    nodes = [compile_node(values[i]) for i in range(1, len(values), 2)]
+    outputs = tuple(node[0] for node in nodes)
     
-    return rgb_to_hex(rgbs[-1])
+    def evaluate(feature, context):
+        return outputs[bisect.bisect_right(stops, label(feature, context))](feature, context)
     
-    # todo: implement color interpolation
+    return evaluate, max([label_depends] + [node[1] for node in nodes])
 
-def interpolate(expression, method, input_value, feature):
+def compile_interpolate(values):
+    expression = values[2:]
     if len(expression) % 2 != 0:
         raise ValueError()
     
-    value = get_value(input_value, feature)
+    factor = get_interpolation_factor(values[0])
+    label, label_depends = compile_node(values[1])
+    stops = tuple(expression[0::2])
+    nodes = [compile_node(output) for output in expression[1::2]]
+    outputs = tuple(node[0] for node in nodes)
+    depends = max([label_depends] + [node[1] for node in nodes])
     
-    if value < expression[0]:
-        return get_value(expression[1], feature)
+    if all(node[1] == depends_none for node in nodes):
+        # 출력이 모두 상수면 색상은 미리 RGB로 바꿔서 표로 만들어 두고, 평가할 때는 bisect와 보간만 수행
+        constants = [output(None, None) for output in outputs]
+        is_color = isinstance(constants[-1], str)
+        table = tuple(color_to_rgb(value) for value in constants) if is_color else tuple(constants)
+        first = constants[0]
+        last = constants[-1]
+        
+        def evaluate(feature, context):
+            value = label(feature, context)
+            
+            if value < stops[0]:
+                return first
+            
+            if value >= stops[-1]:
+                return last
+            
+            i = bisect.bisect_right(stops, value)
+            result = interpolate_value(table[i-1], table[i], factor(value, stops[i-1], stops[i]))
+            
+            return rgb_to_hex(result) if is_color else result
+        
+        return evaluate, depends
     
-    if value >= expression[-2]:
-        return get_value(expression[-1], feature)
+    def evaluate(feature, context):
+        value = label(feature, context)
+        
+        if value < stops[0]:
+            return outputs[0](feature, context)
+        
+        if value >= stops[-1]:
+            return outputs[-1](feature, context)
+        
+        i = bisect.bisect_right(stops, value)
+        t = factor(value, stops[i-1], stops[i])
+        
+        return interpolate_output(outputs[i-1](feature, context), outputs[i](feature, context), t)
     
-    result_type = get_value(expression[-1], feature)
-    if isinstance(result_type, int) or isinstance(result_type, float):
-        for i in range(2, len(expression), 2):
-            if value < expression[i]:
-                right_value = get_value(expression[i+1], feature)
-                left_value = get_value(expression[i-1], feature)
-                return ((value - expression[i-2]) / (expression[i] - expression[i-2])) * (right_value - left_value) + left_value
-    else:
-        return interpolate_color(expression, method, value, feature)
-    
-    # todo: implement exponentional interpolation
-
-def get_value(expression, feature):
-    if isinstance(expression, list):
-        op = expression[0]
-        values = expression[1:]
-        
-        if not isinstance(op, str):
-            return expression
-        
-        if op == '!':
-            return not get_value(values[0], feature)
-        elif op == '==':
-            return get_value(values[0], feature) == get_value(values[1], feature)
-        elif op == '!=':
-            return get_value(values[0], feature) != get_value(values[1], feature)
-        elif op == '>':
-            return get_value(values[0], feature) > get_value(values[1], feature)
-        elif op == '<':
-            return get_value(values[0], feature) < get_value(values[1], feature)
-        elif op == '>=':
-            return get_value(values[0], feature) >= get_value(values[1], feature)
-        elif op == '<=':
-            return get_value(values[0], feature) <= get_value(values[1], feature)
-        elif op == '+':
-            return get_value(values[0], feature) + get_value(values[1], feature)
-        elif op == '-':
-            return get_value(values[0], feature) - get_value(values[1], feature)
-        elif op == '*':
-            return get_value(values[0], feature) * get_value(values[1], feature)
-        elif op == '/':
-            return get_value(values[0], feature) / get_value(values[1], feature)
-        elif op == 'sqrt':
-            return math.sqrt(get_value(values[0], feature))
-        elif op == 'zoom':
-            return properties['zoom']
-        elif op == 'all':
-            for value in values:
-                if not get_value(value, feature):
-                    return False
-            return True
-        elif op == 'any':
-            for value in values:
-                if get_value(value):
-                    return True
-            return False
-        elif op == 'at':
-            if len(values) != 2:
-                raise ValueError()
-            if not isinstance(values[2], list):
-                raise TypeError()
-            return get_value(values[2][get_value(values[1], feature)], feature)
-        elif op == 'get':
-            if values[0] in feature['properties']:
-                return feature['properties'][values[0]]
-            else:
-                return 0
-        elif op == 'has':
-            if len(values) == 1:
-                return bool(values[0] in feature['properties'])
-            else:
-                raise ValueError()
-        elif op == 'literal':
-            return values[0]
-        elif op == 'to-number':
-            return int(get_value(values[0], feature))
-        elif op == 'to-string':
-            return str(get_value(values[0], feature))
-        elif op == 'match':
-            label = get_value(values[0], feature)
-            for i in range(1, len(values) - 1):
-                if isinstance(values[i], list):
-                    if label in values[i]:
-                        return get_value(values[i+1], feature)
-                else:
-                    if label == values[i]:
-                        return get_value(values[i+1], feature)
-            return get_value(values[-1], feature)
-        elif op == 'case':
-            for i in range(0, len(values) - 1, 2):
-                if get_value(values[i], feature):
-                    return get_value(values[i+1], feature)
-            return get_value(values[-1], feature)
-        elif op == 'coalesce':
-            for i in range(0, len(values)):
-                value = get_value(values[i], feature)
-                if value:
-                    return value
-            return get_value(values[-1], feature)
-        elif op == 'step':
-            label = get_value(values[0], feature)
-            for i in range(2, len(values) - 1, 2):
-                if values[i] > label:
-                    return get_value(values[i-1], feature)
-            return get_value(values[-1], feature)
-        elif op == 'interpolate':
-            return interpolate(values[2:], values[0], values[1], feature)
-        elif op == 'geometry-type':
-            geometry_type = feature['geometry']['type']
-            if geometry_type == 'MultiPolygon':
-                return 'Polygon'
-            elif geometry_type == 'MultiLineString':
-                return 'LineString'
-            else:
-                return geometry_type
-        else:
+    return evaluate, depends
+
+def compile_geometry_type(values):
+    return (lambda feature, context: get_geometry_type(feature)), depends_feature
+
+expression_compilers = {
+    '!': compile_not,
+    '==': compile_binary(operator.eq),
+    '!=': compile_binary(operator.ne),
+    '>': compile_binary(operator.gt),
+    '<': compile_binary(operator.lt),
+    '>=': compile_binary(operator.ge),
+    '<=': compile_binary(operator.le),
+    '+': compile_binary(operator.add),
+    '-': compile_binary(operator.sub),
+    '*': compile_binary(operator.mul),
+    '/': compile_binary(operator.truediv),
+    'sqrt': compile_sqrt,
+    'zoom': compile_zoom,
+    'all': compile_all,
+    'any': compile_any,
+    'at': compile_at,
+    'get': compile_get,
+    'has': compile_has,
+    'literal': compile_literal,
+    'to-number': compile_to_number,
+    'to-string': compile_to_string,
+    'match': compile_match,
+    'case': compile_case,
+    'coalesce': compile_coalesce,
+    'step': compile_step,
+    'interpolate': compile_interpolate,
+    'geometry-type': compile_geometry_type,
+}
+
+def compile_node(expression):
+    # (함수, 의존하는 값)을 반환
+    if not isinstance(expression, list) or not expression or not isinstance(expression[0], str):
+        return constant_function(expression), depends_none
+    
+    op = expression[0]
+    
+    if op not in expression_compilers:
+        def unknown_expression(feature, context):
             raise ValueError('Unknown Expression: "{}"'.format(op))
-    else:
-        return expression
+        return unknown_expression, depends_feature
     
-def get_color(color_style, feature = None):
-    if isinstance(color_style, str):
-        return color_to_hex(color_style)
+    try:
+        function, depends = expression_compilers[op](expression[1:])
+    except Exception as e:
+        error = e
+        def invalid_expression(feature, context):
+            raise error
+        return invalid_expression, depends_feature
+    
+    if depends == depends_none:
+        return fold_constant(function, None)
+    
+    return function, depends
+
+def fold_constant(function, context):
+    # 상수 표현식은 미리 계산, 오류는 기존처럼 그릴 때 발생하도록 남겨둠
+    try:
+        return constant_function(function(None, context)), depends_none
+    except Exception:
+        return function, depends_feature
+
+def compile_expression(expression):
+    return compile_node(expression)
+
+def compile_color(color_style):
+    value, depends = compile_node(color_style)
+    function = lambda feature, context: color_to_hex(value(feature, context))
+    
+    if depends == depends_none:
+        return fold_constant(function, None)
+    
+    return function, depends
+
+def compile_properties(layer_properties):
+    compiled = {}
+    
+    for key, expression in layer_properties.items():
+        if key in raw_properties:
+            compiled[key] = (constant_function(expression), depends_none)
+        elif key in color_properties:
+            compiled[key] = compile_color(expression)
+        else:
+            compiled[key] = compile_expression(expression)
+    
+    return compiled
+
+def compile_layer(layer):
+    return {
+        'layer': layer,
+        'filter': compile_expression(layer['filter']) if 'filter' in layer else None,
+        'paint': compile_properties(layer.get('paint', {})),
+        'layout': compile_properties(layer.get('layout', {})),
+    }
+
+def get_style_revision(styles):
+    return '{}:{}'.format(styles.get('version'), styles.get('modified'))
+
+def compile_style(styles):
+    # 스타일 수정 시각(modified)이 같으면 컴파일 결과를 재사용
+    style_key = (styles.get('id'), get_style_revision(styles))
+    
+    if style_key not in compiled_style_cache:
+        compiled_style_cache[style_key] = [compile_layer(layer) for layer in styles['layers']]
+    
+    return compiled_style_cache[style_key]
+
+def resolve_expression(compiled, context):
+    # 줌에만 의존하는 표현식은 해당 줌의 상수로 변환
+    function, depends = compiled
+    
+    if depends == depends_none:
+        return function
+    elif depends == depends_zoom:
+        return fold_constant(function, context)[0]
     else:
-        return color_to_hex(get_value(color_style, feature))
+        return function
 
-def draw_geometry(f, feature, style):
-    style_str = css_style(style)
+def is_layer_visible(layer, zoom):
+    if layer.get('layout', {}).get('visibility') == 'none':
+        return False
+    
+    if 'minzoom' in layer and layer['minzoom'] > zoom:
+        return False
+    
+    if 'maxzoom' in layer and layer['maxzoom'] <= zoom:
+        return False
+    
+    return True
 
-    if feature['geometry']['type'] == 'Polygon':
-        for coords in feature['geometry']['coordinates']:
-            point_str = ''
-            
-            for point in coords:
-                point_str += '{},{} '.format(point[0], point[1])
+def build_render_plan(styles, zoom):
+    context = TileRenderContext(None, None, zoom)
+    layers = []
+    source_layers = {}
+    
+    for compiled_layer in compile_style(styles):
+        layer = compiled_layer['layer']
+        
+        if not is_layer_visible(layer, zoom):
+            continue
+        
+        draw_filter = None
+        
+        if compiled_layer['filter']:
+            draw_filter = resolve_expression(compiled_layer['filter'], context)
             
-            f.write('<polygon points="{}" style="{}" />\n'.format(point_str, style_str))
-    elif feature['geometry']['type'] == 'MultiPolygon':
-        f.write('<g>\n')
-        for polygons in feature['geometry']['coordinates']:
-            for coords in polygons:
-                point_str = ''
+            if compiled_layer['filter'][1] != depends_feature:
+                # 줌만으로 결정되는 필터: 그리지 않는 레이어는 제외
+                try:
+                    if not draw_filter(None, context):
+                        continue
+                    draw_filter = None
+                except Exception:
+                    pass
+        
+        plan_layer = {
+            'layer': layer,
+            'filter': draw_filter,
+            'paint': {key: resolve_expression(compiled, context) for key, compiled in compiled_layer['paint'].items()},
+            'layout': {key: resolve_expression(compiled, context) for key, compiled in compiled_layer['layout'].items()},
+            'vector': compile_vector_layer(layer, compiled_layer, context) if numpy != None else None,
+        }
+        layers.append(plan_layer)
+        
+        if layer['type'] != 'background':
+            source_layers.setdefault(layer['source-layer'], []).append(plan_layer)
+    
+    return {'zoom': zoom, 'layers': layers, 'source_layers': source_layers}
+
+def get_render_plan(styles, zoom):
+    # 같은 스타일, 같은 줌의 타일은 렌더링 계획을 공유
+    plan_key = (styles.get('id'), get_style_revision(styles), zoom)
+    
+    if plan_key not in render_plan_cache:
+        render_plan_cache[plan_key] = build_render_plan(styles, zoom)
+    
+    return render_plan_cache[plan_key]
+
+class VectorizeError(Exception):
+    pass
+
+# 피처에 없는 속성을 나타내는 값
+missing_value = object()
+
+class Categorical():
+    # 범주형 열: 서로 다른 값 목록(categories)과 피처마다 해당 값의 번호(codes)
+    def __init__(self, codes, categories):
+        self.codes = codes
+        self.categories = categories
+    
+    def map(self, function):
+        # 서로 다른 값마다 한 번씩만 계산
+        return Categorical(self.codes, [function(value) for value in self.categories])
+    
+    def values(self):
+        categories = numpy.empty(len(self.categories), dtype = object)
+        categories[:] = self.categories
+        return categories[self.codes]
+    
+    def mask(self):
+        return numpy.array([bool(value) for value in self.categories], dtype = bool)[self.codes]
+
+def factorize(values, count):
+    index = {}
+    categories = []
+    codes = numpy.empty(count, dtype = numpy.intp)
+    
+    for i, value in enumerate(values):
+        # 1, 1.0, True는 같은 키로 취급되므로 타입도 함께 구분
+        key = (value.__class__, value)
+        code = index.get(key)
+        
+        if code == None:
+            code = index[key] = len(categories)
+            categories.append(value)
+        
+        codes[i] = code
+    
+    return Categorical(codes, categories)
+
+class FeatureColumns():
+    # 소스 레이어의 피처 속성을 열 단위로 변환, 열은 처음 사용할 때 만들고 같은 소스 레이어를 쓰는 스타일 레이어끼리 공유
+    def __init__(self, features):
+        self.features = features
+        self.count = len(features)
+        self.columns = {}
+    
+    def column(self, name):
+        if name not in self.columns:
+            self.columns[name] = factorize((feature['properties'].get(name, missing_value) for feature in self.features), self.count)
+        
+        return self.columns[name]
+    
+    def get(self, name):
+        return self.column(name).map(lambda value: 0 if value is missing_value else value)
+    
+    def has(self, name):
+        return self.column(name).map(lambda value: value is not missing_value)
+    
+    def geometry_type(self):
+        if None not in self.columns:
+            self.columns[None] = factorize((get_geometry_type(feature) for feature in self.features), self.count)
+        
+        return self.columns[None]
+
+def is_vector(value):
+    return isinstance(value, (Categorical, numpy.ndarray))
+
+def vector_values(value, count):
+    if isinstance(value, Categorical):
+        return value.values()
+    elif isinstance(value, numpy.ndarray):
+        return value
+    
+    values = numpy.empty(count, dtype = object)
+    values[:] = [value] * count
+    return values
+
+def vector_mask(value, count):
+    if isinstance(value, Categorical):
+        return value.mask()
+    elif isinstance(value, numpy.ndarray):
+        return value.astype(bool)
+    
+    return numpy.full(count, bool(value))
+
+def vector_map(function, value):
+    if isinstance(value, Categorical):
+        return value.map(function)
+    elif isinstance(value, numpy.ndarray):
+        return numpy.frompyfunc(function, 1, 1)(value)
+    
+    return function(value)
+
+def vector_map2(function, left, right):
+    if not is_vector(right):
+        return vector_map(lambda value: function(value, right), left)
+    elif not is_vector(left):
+        return vector_map(lambda value: function(left, value), right)
+    
+    return numpy.frompyfunc(function, 2, 1)(vector_values(left, None), vector_values(right, None))
+
+def compile_vector_unary(func):
+    def compiler(values, context):
+        value = compile_vector_node(values[0], context)
+        return lambda columns: vector_map(func, value(columns))
+    
+    return compiler
+
+def compile_vector_binary(func):
+    def compiler(values, context):
+        left = compile_vector_node(values[0], context)
+        right = compile_vector_node(values[1], context)
+        return lambda columns: vector_map2(func, left(columns), right(columns))
+    
+    return compiler
+
+def compile_vector_all(values, context):
+    functions = [compile_vector_node(value, context) for value in values]
+    
+    def evaluate(columns):
+        mask = numpy.ones(columns.count, dtype = bool)
+        for function in functions:
+            mask &= vector_mask(function(columns), columns.count)
+        return mask
+    
+    return evaluate
+
+def compile_vector_any(values, context):
+    functions = [compile_vector_node(value, context) for value in values]
+    
+    def evaluate(columns):
+        mask = numpy.zeros(columns.count, dtype = bool)
+        for function in functions:
+            mask |= vector_mask(function(columns), columns.count)
+        return mask
+    
+    return evaluate
+
+def compile_vector_get(values, context):
+    name = values[0]
+    return lambda columns: columns.get(name)
+
+def compile_vector_has(values, context):
+    if len(values) != 1:
+        raise VectorizeError()
+    
+    name = values[0]
+    return lambda columns: columns.has(name)
+
+def compile_vector_match(values, context):
+    # 출력값이 모두 상수일 때만 벡터화: 범주마다 한 번씩 조회
+    label = compile_vector_node(values[0], context)
+    default = evaluate_vector_constant(values[-1], context)
+    table = {}
+    
+    for i in range(1, len(values) - 1, 2):
+        output = evaluate_vector_constant(values[i + 1], context)
+        
+        labels = values[i] if isinstance(values[i], list) else [values[i]]
+        for key in labels:
+            if key not in table:
+                table[key] = output
+    
+    lookup = table.get
+    return lambda columns: vector_map(lambda value: lookup(value, default), label(columns))
+
+def compile_vector_case(values, context):
+    branches = [(compile_vector_node(values[i], context), compile_vector_node(values[i + 1], context)) for i in range(0, len(values) - 1, 2)]
+    default = compile_vector_node(values[-1], context)
+    
+    def evaluate(columns):
+        conditions = [vector_mask(condition(columns), columns.count) for condition, output in branches]
+        outputs = [vector_values(output(columns), columns.count) for condition, output in branches]
+        return numpy.select(conditions, outputs, vector_values(default(columns), columns.count))
+    
+    return evaluate
+
+def compile_vector_geometry_type(values, context):
+    return lambda columns: columns.geometry_type()
+
+vector_compilers = {
+    '!': compile_vector_unary(operator.not_),
+    '==': compile_vector_binary(operator.eq),
+    '!=': compile_vector_binary(operator.ne),
+    '>': compile_vector_binary(operator.gt),
+    '<': compile_vector_binary(operator.lt),
+    '>=': compile_vector_binary(operator.ge),
+    '<=': compile_vector_binary(operator.le),
+    '+': compile_vector_binary(operator.add),
+    '-': compile_vector_binary(operator.sub),
+    '*': compile_vector_binary(operator.mul),
+    '/': compile_vector_binary(operator.truediv),
+    'sqrt': compile_vector_unary(math.sqrt),
+    'all': compile_vector_all,
+    'any': compile_vector_any,
+    'get': compile_vector_get,
+    'has': compile_vector_has,
+    'to-number': compile_vector_unary(int),
+    'to-string': compile_vector_unary(str),
+    'match': compile_vector_match,
+    'case': compile_vector_case,
+    'geometry-type': compile_vector_geometry_type,
+}
+
+def evaluate_vector_constant(expression, context):
+    function, depends = compile_node(expression)
+    
+    if depends == depends_feature:
+        raise VectorizeError()
+    
+    try:
+        return function(None, context)
+    except Exception:
+        raise VectorizeError()
+
+def compile_vector_node(expression, context):
+    # 함수(columns)를 반환, 결과는 상수, Categorical 또는 피처 수만큼의 배열
+    function, depends = compile_node(expression)
+    
+    if depends != depends_feature:
+        # 피처에 의존하지 않는 부분식은 해당 줌의 상수로 계산
+        value = evaluate_vector_constant(expression, context)
+        return lambda columns: value
+    
+    if not isinstance(expression, list) or not expression or expression[0] not in vector_compilers:
+        raise VectorizeError()
+    
+    return vector_compilers[expression[0]](expression[1:], context)
+
+def compile_vector(expression, context):
+    # 벡터화할 수 없는 표현식이면 None, 피처마다 계산하는 기존 함수를 사용
+    try:
+        return compile_vector_node(expression, context)
+    except VectorizeError:
+        return None
+
+def compile_vector_color(function):
+    return lambda columns: vector_map(color_to_hex, function(columns))
+
+def compile_vector_layer(layer, compiled_layer, context):
+    vector_filter = None
+    
+    if compiled_layer['filter'] and compiled_layer['filter'][1] == depends_feature:
+        vector_filter = compile_vector(layer['filter'], context)
+    
+    # 도형 스타일에 쓰이는 속성 중 피처에 의존하는 것만 미리 계산
+    vector_properties = {}
+    
+    if layer['type'] == 'fill' or layer['type'] == 'line':
+        for group in ('paint', 'layout'):
+            for key, expression in layer.get(group, {}).items():
+                if key in raw_properties or compiled_layer[group][key][1] != depends_feature:
+                    continue
                 
-                for point in coords:
-                    point_str += '{},{} '.format(point[0], point[1])
+                function = compile_vector(expression, context)
+                if function == None:
+                    continue
                 
-                f.write('<polygon points="{}" style="{}" />\n'.format(point_str, style_str))
-        f.write('</g>\n')
-    elif feature['geometry']['type'] == 'LineString':
-        point_str = ''
+                vector_properties[key] = compile_vector_color(function) if key in color_properties else function
+    
+    return {'filter': vector_filter, 'properties': vector_properties}
+
+def get_feature_columns(columns_cache, key, features):
+    if columns_cache == None:
+        return None
+    
+    if key not in columns_cache:
+        columns_cache[key] = FeatureColumns(features)
+    
+    return columns_cache[key]
+
+def filter_features(plan_layer, features, context, columns = None):
+    # 필터를 통과한 (피처, 미리 계산한 속성값) 목록
+    # columns가 있으면 벡터화한 필터와 속성을 레이어의 모든 피처에 대해 한 번에 계산하고, 실패하면 피처마다 계산
+    vector = plan_layer['vector'] if columns != None else None
+    
+    if vector and (vector['filter'] or vector['properties']):
+        try:
+            if vector['filter']:
+                mask = vector_mask(vector['filter'](columns), columns.count)
+            elif plan_layer['filter']:
+                mask = numpy.fromiter((bool(plan_layer['filter'](feature, context)) for feature in features), dtype = bool, count = columns.count)
+            else:
+                mask = numpy.ones(columns.count, dtype = bool)
             
-        for point in feature['geometry']['coordinates']:
-            point_str += '{},{} '.format(point[0], point[1])
+            indices = numpy.flatnonzero(mask)
+            properties = {key: vector_values(function(columns), columns.count)[indices] for key, function in vector['properties'].items()}
+        except Exception:
+            pass
+        else:
+            return [(features[i], {key: values[n] for key, values in properties.items()}) for n, i in enumerate(indices.tolist())]
+    
+    return [(feature, None) for feature in features if not plan_layer['filter'] or plan_layer['filter'](feature, context)]
+
+def clip_intersection(p1, p2, edge, value):
+    if edge == 0 or edge == 1:
+        t = (value - p1[0]) / (p2[0] - p1[0])
+        return (value, round(p1[1] + t * (p2[1] - p1[1])))
+    else:
+        t = (value - p1[1]) / (p2[1] - p1[1])
+        return (round(p1[0] + t * (p2[0] - p1[0])), value)
+
+def clip_ring(ring, clip_rect):
+    # Sutherland-Hodgman 알고리즘
+    x1, y1, x2, y2 = clip_rect
+    edges = ((0, x1, lambda p: p[0] >= x1), (1, x2, lambda p: p[0] <= x2), (2, y1, lambda p: p[1] >= y1), (3, y2, lambda p: p[1] <= y2))
+    points = [(p[0], p[1]) for p in ring]
+    
+    for edge, value, inside in edges:
+        if not points:
+            break
         
-        f.write('<polyline points="{}" style="{}" />\n'.format(point_str, style_str))
-    elif feature['geometry']['type'] == 'MultiLineString':
-        f.write('<g>\n')
-        for polylines in feature['geometry']['coordinates']:
-            point_str = ''
-                
-            for point in polylines:
-                point_str += '{},{} '.format(point[0], point[1])
+        result = []
+        prev = points[-1]
+        prev_inside = inside(prev)
+        
+        for point in points:
+            point_inside = inside(point)
+            
+            if point_inside:
+                if not prev_inside:
+                    result.append(clip_intersection(prev, point, edge, value))
+                result.append(point)
+            elif prev_inside:
+                result.append(clip_intersection(prev, point, edge, value))
+            
+            prev = point
+            prev_inside = point_inside
+        
+        points = result
+    
+    if len(points) < 3:
+        return None
+    
+    return points
+
+def clip_segment(p1, p2, clip_rect):
+    # Liang-Barsky 알고리즘
+    x1, y1, x2, y2 = clip_rect
+    dx = p2[0] - p1[0]
+    dy = p2[1] - p1[1]
+    t0 = 0
+    t1 = 1
+    
+    for p, q in ((-dx, p1[0] - x1), (dx, x2 - p1[0]), (-dy, p1[1] - y1), (dy, y2 - p1[1])):
+        if p == 0:
+            if q < 0:
+                return None
+        else:
+            t = q / p
+            if p < 0:
+                if t > t1:
+                    return None
+                if t > t0:
+                    t0 = t
+            else:
+                if t < t0:
+                    return None
+                if t < t1:
+                    t1 = t
+    
+    start = p1 if t0 == 0 else (round(p1[0] + t0 * dx), round(p1[1] + t0 * dy))
+    end = p2 if t1 == 1 else (round(p1[0] + t1 * dx), round(p1[1] + t1 * dy))
+    
+    return start, end
+
+def clip_line(line, clip_rect):
+    points = [(p[0], p[1]) for p in line]
+    lines = []
+    current = []
+    
+    for i in range(len(points) - 1):
+        segment = clip_segment(points[i], points[i+1], clip_rect)
+        
+        if segment == None:
+            if current:
+                lines.append(current)
+                current = []
+            continue
+        
+        start, end = segment
+        
+        if current and current[-1] != start:
+            lines.append(current)
+            current = []
+        
+        if not current:
+            current = [start]
+        current.append(end)
+        
+        if end != points[i+1]:
+            lines.append(current)
+            current = []
+    
+    if current:
+        lines.append(current)
+    
+    # 꼭짓점에만 닿은 선분처럼 길이가 없는 조각은 제외
+    return [line for line in lines if len(line) > 2 or line[0] != line[1]]
+
+def get_bounds(points):
+    xs = [p[0] for p in points]
+    ys = [p[1] for p in points]
+    return (min(xs), min(ys), max(xs), max(ys))
+
+def clip_test(points, clip_rect):
+    # 1: 영역 안, -1: 영역 밖, 0: 경계에 걸침
+    bounds = get_bounds(points)
+    
+    if bounds[0] >= clip_rect[0] and bounds[1] >= clip_rect[1] and bounds[2] <= clip_rect[2] and bounds[3] <= clip_rect[3]:
+        return 1
+    if bounds[2] < clip_rect[0] or bounds[3] < clip_rect[1] or bounds[0] > clip_rect[2] or bounds[1] > clip_rect[3]:
+        return -1
+    return 0
+
+def clip_polygon(polygon, clip_rect):
+    rings = []
+    
+    for ring in polygon:
+        test = clip_test(ring, clip_rect)
+        
+        if test == 1:
+            rings.append(ring)
+        elif test == 0:
+            clipped = clip_ring(ring, clip_rect)
+            if clipped:
+                rings.append(clipped)
+    
+    return rings
+
+def clip_geometry(geometry, clip_rect):
+    # 영역 밖으로 완전히 벗어난 도형은 None
+    geometry_type = geometry['type']
+    coordinates = geometry['coordinates']
+    
+    if geometry_type == 'Point':
+        if clip_rect[0] <= coordinates[0] <= clip_rect[2] and clip_rect[1] <= coordinates[1] <= clip_rect[3]:
+            return geometry
+        return None
+    elif geometry_type == 'Polygon':
+        rings = clip_polygon(coordinates, clip_rect)
+        
+        if not rings:
+            return None
+        return {'type': 'Polygon', 'coordinates': rings}
+    elif geometry_type == 'MultiPolygon':
+        polygons = []
+        
+        for polygon in coordinates:
+            rings = clip_polygon(polygon, clip_rect)
+            if rings:
+                polygons.append(rings)
+        
+        if not polygons:
+            return None
+        return {'type': 'MultiPolygon', 'coordinates': polygons}
+    elif geometry_type == 'LineString' or geometry_type == 'MultiLineString':
+        lines = []
+        
+        for line in (coordinates if geometry_type == 'MultiLineString' else [coordinates]):
+            test = clip_test(line, clip_rect)
             
-            f.write('<polyline points="{}" style="{}" />\n'.format(point_str, style_str))
+            if test == 1:
+                lines.append(line)
+            elif test == 0:
+                lines += clip_line(line, clip_rect)
+        
+        if not lines:
+            return None
+        elif len(lines) == 1:
+            return {'type': 'LineString', 'coordinates': lines[0]}
+        else:
+            return {'type': 'MultiLineString', 'coordinates': lines}
+    else:
+        return geometry
+
+def get_geometry_lines(geometry):
+    # 폴리곤의 구멍은 MVT의 링 방향(외곽과 반대)에 따라 nonzero 규칙으로 처리됨
+    if geometry['type'] == 'Polygon':
+        return geometry['coordinates'], True
+    elif geometry['type'] == 'MultiPolygon':
+        return [ring for polygon in geometry['coordinates'] for ring in polygon], True
+    elif geometry['type'] == 'LineString':
+        return [geometry['coordinates']], False
+    elif geometry['type'] == 'MultiLineString':
+        return geometry['coordinates'], False
+    
+    return [], False
+
+def encode_path(lines, closed, pen = (0, 0)):
+    # MVT 정수 좌표를 그대로 사용해 상대 좌표(m/l) 경로로 변환
+    # 다음 경로가 이어서 쓸 수 있도록 마지막 펜 위치를 함께 반환
+    pen_x, pen_y = pen
+    path_data = []
+    
+    for line in lines:
+        if len(line) < 2:
+            continue
+        
+        start_x, start_y = line[0]
+        
+        if closed and line[-1][0] == start_x and line[-1][1] == start_y:
+            # 닫힌 링의 마지막 점은 z와 같으므로 생략
+            line = line[:-1]
+        
+        path_data.append('m{} {}l'.format(start_x - pen_x, start_y - pen_y))
+        path_data.append(' '.join('{} {}'.format(x2 - x1, y2 - y1) for (x1, y1), (x2, y2) in zip(line, line[1:])))
+        
+        if closed:
+            path_data.append('z')
+            pen_x, pen_y = start_x, start_y
+        else:
+            pen_x, pen_y = line[-1]
+    
+    return ''.join(path_data), (pen_x, pen_y)
+
+def draw_geometry(f, feature, style, context):
+    if context.clip_rect:
+        geometry = clip_geometry(feature['geometry'], context.clip_rect)
+        
+        if geometry == None:
+            return
+        
+        feature = {'geometry': geometry, 'properties': feature['properties']}
+    
+    style_class = context.stylesheet.get_class(style)
+    lines, closed = get_geometry_lines(feature['geometry'])
+    
+    if context.merge_paths:
+        context.add_path(f, style_class, lines, closed)
+        return
+    
+    is_multi = feature['geometry']['type'].startswith('Multi')
+    
+    if is_multi:
+        f.write('<g>\n')
+    
+    for line in lines:
+        path_data = encode_path([line], closed)[0]
+        
+        if path_data:
+            f.write('<path d="{}" class="{}" />\n'.format(path_data, style_class))
+    
+    if is_multi:
         f.write('</g>\n')
 
-def draw_symbol(f, feature, layout, paint):
+def draw_symbol(f, feature, layout, paint, context):
+    if context.clip_rect and clip_geometry(feature['geometry'], context.clip_rect) == None:
+        return
+    
     if feature['geometry']['type'] == 'Point':
         coord = feature['geometry']['coordinates']
         icon_image = None
         
         if 'icon-image' in layout:
-            icon_image = layout['icon-image']
+            icon_image = layout['icon-image'](feature, context)
         
         if icon_image:
-            sprite = load_sprite(get_value(icon_image, feature))
+            sprite = load_sprite(icon_image)
             size = 1
             
             if 'icon-size' in layout:
-                size = get_value(layout['icon-size'], feature)
+                size = layout['icon-size'](feature, context)
             
             size *= 8
             x = coord[0] - (sprite['size'][0] / 2) * size
             y = coord[1] + (sprite['size'][1] / 2) * size
             
-            f.write('<g transform="translate({0}, {1}) scale({2}, -{2})">'.format(x, y, size))
-            f.write(sprite['image'])
-            f.write('</g>\n')
+            f.write('<use xlink:href="#{0}" width="{1}" height="{2}" transform="translate({3}, {4}) scale({5}, -{5})" />\n'.format(context.stylesheet.get_sprite_id(icon_image), sprite['size'][0], sprite['size'][1], x, y, size))
         
         if 'text-field' in layout:
-            text = get_value(layout['text-field'], feature)
+            text = layout['text-field'](feature, context)
             text_style = {'fill': '#111111', 'stroke': 'none', 'text-anchor': 'middle', 'font-size': 15, 'text-align': 'center'}
             
             if 'text-font' in layout:
-                text_style['font-family'] = layout['text-font'][0]
+                text_style['font-family'] = layout['text-font'](feature, context)[0]
             
             if 'text-size' in layout:
-                text_style['font-size'] = get_value(layout['text-size'], feature) * 8
+                text_style['font-size'] = layout['text-size'](feature, context) * 8
                 text_style['stroke-width'] = text_style['font-size'] / 4
             
             if 'text-color' in paint:
-                text_style['fill'] = get_color(paint['text-color'], feature)
+                text_style['fill'] = paint['text-color'](feature, context)
                 
             if 'text-halo-color' in paint:
-                text_style['stroke'] = get_color(paint['text-halo-color'], feature)
+                text_style['stroke'] = paint['text-halo-color'](feature, context)
             
             x = coord[0]
             y = coord[1]
             
             if 'text-offset' in layout:
-                text_offset = get_value(layout['text-offset'], feature)
+                text_offset = layout['text-offset'](feature, context)
                 
                 x += text_offset[0] * text_style['font-size']
                 y -= text_offset[1] * text_style['font-size']
             
             if text_style['stroke'] != 'none':
-                f.write('<text x="0" y="0" transform="translate({}, {}) scale(1, -1)" style="{}">{}</text>\n'.format(x, y, css_style(text_style), text))
+                f.write('<text x="0" y="0" transform="translate({}, {}) scale(1, -1)" class="{}">{}</text>\n'.format(x, y, context.stylesheet.get_class(text_style), text))
             
             text_style['stroke'] = 'none'
-            f.write('<text x="0" y="0" transform="translate({}, {}) scale(1, -1)" style="{}">{}</text>\n'.format(x, y, css_style(text_style), text))
+            f.write('<text x="0" y="0" transform="translate({}, {}) scale(1, -1)" class="{}">{}</text>\n'.format(x, y, context.stylesheet.get_class(text_style), text))
+
+def get_sprite_symbol_id(sprite_id):
+    return 'sprite-' + ''.join(c if c.isalnum() or c in '-_' else '_' for c in sprite_id)
+
+def load_sprite_atlas():
+    # styles 폴더의 스프라이트를 한 번에 읽음, 속성은 XML 파서로 읽고 내용은 그대로 사용
+    atlas = {}
+    sprite_dir = resource_path('styles')
+    
+    for filename in os.listdir(sprite_dir):
+        if not filename.endswith('.svg'):
+            continue
+        
+        with open(os.path.join(sprite_dir, filename), mode='r', encoding='utf-8') as f:
+            svg_text = f.read()
+        
+        root = elemtree.fromstring(svg_text)
+        image = svg_text[svg_text.index('>') + 1:svg_text.rindex('</')]
+        
+        atlas[filename[:-4]] = {'image': image, 'size': (int(root.get('width')), int(root.get('height')))}
+    
+    sprite_cache.update(atlas)
 
 def load_sprite(sprite_id):
-    if sprite_id in sprite_cache:
-        return sprite_cache[sprite_id]
+    if not sprite_cache:
+        load_sprite_atlas()
     
-    sprite_path = resource_path('styles/{}.svg'.format(sprite_id))
+    if not sprite_id in sprite_cache:
+        raise FileNotFoundError('Sprite not found: {}'.format(sprite_id))
     
-    with open(sprite_path, mode='r', encoding='utf-8') as f:
-        svg_text = f.read()
+    return sprite_cache[sprite_id]
+
+def read_style_cache(cache_filename):
+    try:
+        with open(cache_filename, mode='r', encoding='utf-8') as f:
+            cache_json = json.load(f)
+        return cache_json['fetched'], cache_json['style']
+    except (OSError, ValueError, KeyError):
+        return None
+
+def write_style_cache(cache_filename, fetched, styles):
+    cache_json = {'fetched': fetched, 'revision': get_style_revision(styles), 'style': styles}
+    # 여러 스레드/프로세스가 같은 스타일을 동시에 저장해도 서로의 임시 파일을 건드리지 않도록 고유한 이름 사용
+    fd, temp_filename = tempfile.mkstemp(dir = os.path.dirname(cache_filename) or '.', suffix = '.tmp')
     
-    match = re.match(r'<svg (.*?)>(.*)</svg>', svg_text)
-    if match:
-        w = re.search(r'width="([0-9]+)"', match[1])
-        h = re.search(r'height="([0-9]+)"', match[1])
-        
-        sprite_cache[sprite_id] = {'image': match[2], 'size': (int(w[1]), int(h[1]))}
-        return sprite_cache[sprite_id]
-    else:
-        raise ValueError()
+    try:
+        with os.fdopen(fd, mode='w', encoding='utf-8') as f:
+            json.dump(cache_json, f)
+        os.replace(temp_filename, cache_filename)
+    except BaseException:
+        try:
+            os.remove(temp_filename)
+        except OSError:
+            pass
+        raise
 
-def load_tile(style_id, token, x, y, zoom, draw_full_svg = True, clip_mask = True, fp = None):
-    properties['x'] = x
-    properties['y'] = y
-    properties['zoom'] = zoom
+def load_style(style_id, token, cache_dir = None, refresh = False):
+    # 스타일 JSON은 프로세스당 한 번만 받고, 만료되기 전까지 디스크 캐시를 사용
+    now = time.time()
+    cached = style_cache.get(style_id)
+    cache_filename = None
     
-    # Load styles
-    style_response = requests.get(style_url.format(style_id), params = {'access_token': token})
-    styles = style_response.json()
+    if cache_dir:
+        style_cache_dir = os.path.join(cache_dir, 'styles')
+        if not os.path.exists(style_cache_dir):
+            os.makedirs(style_cache_dir)
+        
+        cache_filename = os.path.join(style_cache_dir, style_id.replace('/', '_') + '.json')
+        
+        if cached == None:
+            cached = read_style_cache(cache_filename)
+    
+    if cached and not refresh and now - cached[0] < style_ttl:
+        style_cache[style_id] = cached
+        return cached[1]
+    
+    try:
+        style_response = http_client.get(style_url.format(style_id), params = {'access_token': token})
+        styles = style_response.json()
+    except (requests.exceptions.RequestException, ValueError):
+        # 재검증에 실패하면 만료된 스타일이라도 사용
+        if cached:
+            return cached[1]
+        raise
     
     if style_response.status_code != 200:
         if 'message' in styles:
             raise MapBoxError(styles['message'])
+        raise MapBoxError('Style request failed: {}'.format(style_response.status_code))
+    
+    style_cache[style_id] = (now, styles)
     
-    # Get tileset sources
+    if cache_filename:
+        write_style_cache(cache_filename, now, styles)
+    
+    return styles
+
+def get_tile_source(styles):
     if re.match(r'mapbox://', styles['sources']['composite']['url']) and styles['sources']['composite']['type'] == 'vector':
-        sources = styles['sources']['composite']['url'][9:]
+        return styles['sources']['composite']['url'][9:]
     else:
         raise ValueError()
+
+def fetch_tile(styles, token, x, y, zoom, tile_store = None, session = None, timeout = None, refresh = False):
+    # refresh이면 캐시를 무시하고 새로 받아서 저장
+    sources = get_tile_source(styles)
     
-    # Load tilesets
-    tile_response = requests.get(tile_url.format(sources, zoom, x, y), params = {'access_token': token})
+    if tile_store and not refresh:
+        data = tile_store.get_tile(sources, x, y, zoom)
+        if data != None:
+            return data
+    
+    tile_response = http_client.get(tile_url.format(sources, zoom, x, y), params = {'access_token': token}, timeout = timeout, session = session)
+    
+    if tile_response.status_code >= 400:
+        raise MapBoxError('Tile request failed: {}'.format(tile_response.status_code))
+    
+    if tile_store and tile_response.status_code == 200:
+        tile_store.put_tile(sources, x, y, zoom, tile_response.content)
+    
+    return tile_response.content
 
-    tile = mapbox_vector_tile.decode(tile_response.content)
+def load_tile(styles, token, x, y, zoom, draw_full_svg = True, clip_mask = True, fp = None, tile_store = None, session = None, timeout = None):
+    tile = decode_tile(fetch_tile(styles, token, x, y, zoom, tile_store = tile_store, session = session, timeout = timeout), x, y, zoom, source_layers = get_render_plan(styles, zoom)['source_layers'])
     
-    if fp == None:
-        f = io.StringIO()
+    return render_tile(styles, tile, x, y, zoom, draw_full_svg = draw_full_svg, clip_mask = clip_mask, fp = fp)
+
+def render_tile_fragment(styles, data, x, y, zoom, clip_rect = None, merge_paths = False, parent_zoom = None, vectorize = False):
+    # 캐시용: <svg>로 감싸지 않은 본문과 사용한 CSS 규칙, 스프라이트를 따로 반환
+    # parent_zoom이 주어지면 data는 상위 타일이며, 그 중 (x, y, zoom) 영역만 확대해서 렌더링
+    stylesheet = StyleSheet()
+    tile = decode_tile(data, x, y, zoom, parent_zoom, get_render_plan(styles, zoom)['source_layers'])
+    
+    if parent_zoom != None and clip_rect == None:
+        clip_rect = (-16, -16, 4112, 4112)
+    
+    body = render_tile(styles, tile, x, y, zoom, draw_full_svg = False, clip_rect = clip_rect, stylesheet = stylesheet, merge_paths = merge_paths, vectorize = vectorize)
+    
+    return body, stylesheet.css(), sorted(stylesheet.sprites)
+
+class LazyFeature(dict):
+    # 속성만 먼저 디코딩하고 지오메트리는 처음 사용할 때(필터를 통과한 뒤) 디코딩
+    def __init__(self, properties, feature, layer_decoder):
+        super().__init__(properties = properties)
+        self.feature = feature
+        self.layer_decoder = layer_decoder
+    
+    def __missing__(self, key):
+        if key != 'geometry':
+            raise KeyError(key)
+        
+        geometry = self['geometry'] = self.layer_decoder.decode_geometry(self.feature)
+        self.feature = None
+        return geometry
+    
+    def geometry_type(self):
+        # geometry-type 표현식의 값, 지오메트리를 디코딩하지 않고 MVT 도형 종류와 첫 명령만으로 판단
+        if self.feature == None:
+            return get_geometry_type(self)
+        
+        if self.feature.type == 1:
+            # 점은 MoveTo 명령의 개수로 Point/MultiPoint 구분
+            return 'Point' if len(self.feature.geometry) > 0 and self.feature.geometry[0] >> 3 == 1 else 'MultiPoint'
+        elif self.feature.type == 2:
+            return 'LineString'
+        elif self.feature.type == 3:
+            return 'Polygon'
+        
+        return get_geometry_type(self)
+
+class LayerDecoder():
+    def __init__(self, tile_data, layer, transformer = None):
+        self.tile_data = tile_data
+        self.extent = layer.extent
+        self.transformer = transformer
+    
+    def decode_geometry(self, feature):
+        return self.tile_data.parse_geometry(feature.geometry, feature.type, self.extent, False, self.transformer)
+
+def get_geometry_type(feature):
+    if isinstance(feature, LazyFeature) and 'geometry' not in feature:
+        return feature.geometry_type()
+    
+    geometry_type = feature['geometry']['type']
+    if geometry_type == 'MultiPolygon':
+        return 'Polygon'
+    elif geometry_type == 'MultiLineString':
+        return 'LineString'
     else:
-        f = fp
+        return geometry_type
+
+def get_overzoom_transformer(x, y, zoom, parent_zoom):
+    # 상위 타일 좌표를 (x, y, zoom) 타일 좌표로 변환, 영역 밖의 도형은 렌더링할 때 잘라냄
+    scale = 2 ** (zoom - parent_zoom)
+    size = 4096 // scale
+    offset_x = (x % scale) * size
+    offset_y = 4096 - (y % scale + 1) * size
+    
+    return lambda px, py: ((px - offset_x) * scale, (py - offset_y) * scale)
+
+def decode_tile(data, x, y, zoom, parent_zoom = None, source_layers = None):
+    # source_layers가 주어지면 해당 소스 레이어만 디코딩 (렌더링 계획의 source_layers)
+    # 레이어 목록은 protobuf 파싱으로 바로 얻고, 파이썬 객체로는 필요한 레이어의 속성만 변환
+    tile_data = mapbox_vector_tile.decoder.TileData(data)
+    transformer = None
+    
+    if parent_zoom != None:
+        transformer = get_overzoom_transformer(x, y, zoom, parent_zoom)
+    
+    tile = {}
+    for layer in tile_data.tile.layers:
+        if source_layers != None and layer.name not in source_layers:
+            continue
+        
+        layer_decoder = LayerDecoder(tile_data, layer, transformer)
+        keys = list(layer.keys)
+        values = [tile_data.parse_value(value) for value in layer.values]
+        
+        features = []
+        for feature in layer.features:
+            tags = feature.tags
+            properties = {keys[tags[i]]: values[tags[i + 1]] for i in range(0, len(tags) - 1, 2)}
+            features.append(LazyFeature(properties, feature, layer_decoder))
+        
+        tile[layer.name] = {'features': features}
+    
+    return tile
+
+def find_parent_tile(styles, tile_store, x, y, zoom, max_levels = 2):
+    # 캐시에 있는 가장 가까운 상위 타일의 (MVT, 줌 레벨)
+    sources = get_tile_source(styles)
+    
+    for parent_zoom in range(zoom - 1, max(zoom - max_levels, 0) - 1, -1):
+        shift = zoom - parent_zoom
+        data = tile_store.get_tile(sources, x >> shift, y >> shift, parent_zoom)
+        
+        if data != None:
+            return data, parent_zoom
+    
+    return None
+
+def init_render_worker(styles):
+    global worker_styles
+    worker_styles = styles
+
+def render_fragment_worker(data, x, y, zoom, clip_rect = None, merge_paths = False, parent_zoom = None, vectorize = False):
+    # 프로세스 풀에서 실행: MVT 디코딩과 SVG 생성 모두 작업자 프로세스에서 처리
+    return render_tile_fragment(worker_styles, data, x, y, zoom, clip_rect = clip_rect, merge_paths = merge_paths, parent_zoom = parent_zoom, vectorize = vectorize)
+
+def get_feature_style(layer, paint, layout, feature, context, values = None):
+    # values: filter_features에서 미리 계산한 속성값
+    def evaluate(properties, key):
+        if values and key in values:
+            return values[key]
+        return properties[key](feature, context)
+    
+    if layer['type'] == 'fill':
+        feature_style = {'fill': '#000000', 'opacity': 1}
+        
+        if 'fill-color' in paint:
+            feature_style['fill'] = evaluate(paint, 'fill-color')
+        
+        if 'opacity' in paint:
+            feature_style['opacity'] = evaluate(paint, 'opacity')
+    else:
+        feature_style = {'fill': 'none', 'stroke': '#000000', 'stroke-width': 1, 'stroke-opacity': 1}
+        
+        if 'line-color' in paint:
+            feature_style['stroke'] = evaluate(paint, 'line-color')
+            
+        if 'line-width' in paint:
+            feature_style['stroke-width'] = evaluate(paint, 'line-width') * 8
+        
+        if 'line-opacity' in paint:
+            feature_style['stroke-opacity'] = evaluate(paint, 'line-opacity')
         
+        if 'line-dasharray' in paint:
+            line_dasharray = evaluate(paint, 'line-dasharray')
+            if not isinstance(line_dasharray, list):
+                raise TypeError()
+            
+            dasharray_str = ''
+            for dash in line_dasharray:
+                dasharray_str += '{} '.format(dash)
+                
+            feature_style['stroke-dasharray'] = dasharray_str
+        
+        if 'line-cap' in layout:
+            feature_style['stroke-linecap'] = evaluate(layout, 'line-cap')
+        
+        if 'line-join' in layout:
+            feature_style['stroke-linejoin'] = evaluate(layout, 'line-join')
+    
+    return feature_style
+
+def render_tile(styles, tile, x, y, zoom, draw_full_svg = True, clip_mask = True, fp = None, clip_rect = None, stylesheet = None, merge_paths = False, vectorize = False):
+    # draw_full_svg가 아니면 사용한 클래스는 stylesheet에 모아두고, <style> 출력은 호출한 쪽에서 처리
+    # vectorize이면 NumPy가 있을 때 필터와 속성을 레이어 단위로 한 번에 계산
+    context = TileRenderContext(x, y, zoom, clip_rect = clip_rect, stylesheet = stylesheet, merge_paths = merge_paths)
+    columns_cache = {} if vectorize and numpy != None else None
+    
+    if fp == None:
+        output = io.StringIO()
+    else:
+        output = fp
+    
     if draw_full_svg:
-        f.write('<?xml version="1.0" encoding="UTF-8" standalone="no"?>\n')
-        f.write('<svg width="4096" height="4096" viewBox="0 0 4096 4096" xmlns="http://www.w3.org/2000/svg" xmlns:inkscape="http://www.inkscape.org/namespaces/inkscape" xmlns:sodipodi="http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd"><style></style>\n')
-        f.write('<sodipodi:namedview id="namedview1" pagecolor="#ffffff" bordercolor="#cccccc" borderopacity="1" inkscape:deskcolor="#e5e5e5"/>\n')
+        # <style> 블록을 도형보다 먼저 써야 하므로 본문은 따로 모아둠
+        f = io.StringIO()
+    else:
+        f = output
     
     if clip_mask:
         f.write('<defs><clipPath id="map-clip-mask"><rect x="0" y="0" width="4112" height="4112" /></clipPath></defs>\n')
@@ -395,14 +1566,14 @@ def load_tile(style_id, token, x, y, zoom, draw_full_svg = True, clip_mask = Tru
     else:
         f.write('<g id="map" transform="scale(1, -1) translate(0, -4096)">')
     
-    for layer in styles['layers']:
-        if 'minzoom' in layer:
-            if layer['minzoom'] > properties['zoom']:
-                continue
+    for plan_layer in get_render_plan(styles, zoom)['layers']:
+        layer = plan_layer['layer']
+        paint = plan_layer['paint']
+        layout = plan_layer['layout']
         
         if layer['type'] == 'background':
-            if 'background-color' in layer['paint']:
-                fill = get_color(layer['paint']['background-color'])
+            if 'background-color' in paint:
+                fill = paint['background-color'](None, context)
                 f.write('<g id="{0}"><rect x="0" y="0" width="4096" height="4096" fill="{1}" stroke="{1}" stroke-width="32" /></g>'.format(layer['id'], fill))
         else:
             if not layer['source-layer'] in tile:
@@ -410,67 +1581,183 @@ def load_tile(style_id, token, x, y, zoom, draw_full_svg = True, clip_mask = Tru
             
             f.write('<g id="{}">'.format(layer['id']))
             source_layer = tile[layer['source-layer']]
+            columns = get_feature_columns(columns_cache, layer['source-layer'], source_layer['features'])
             
-            for feature in source_layer['features']:
-                draw_filter = True
-                
-                if 'filter' in layer:
-                    draw_filter = get_value(layer['filter'], feature)
-                
-                if draw_filter:
-                    if layer['type'] == 'fill':
-                        feature_style = {'fill': '#000000', 'opacity': 1}
-                        
-                        if 'paint' in layer:
-                            if 'fill-color' in layer['paint']:
-                                feature_style['fill'] = get_color(layer['paint']['fill-color'], feature)
-                            
-                            if 'opacity' in layer['paint']:
-                                feature_style['opacity'] = get_value(layer['paint']['opacity'], feature)
-                        
-                        draw_geometry(f, feature, feature_style)
-                    elif layer['type'] == 'line':
-                        feature_style = {'fill': 'none', 'stroke': '#000000', 'stroke-width': 1, 'stroke-opacity': 1}
-                        
-                        if 'paint' in layer:
-                            if 'line-color' in layer['paint']:
-                                feature_style['stroke'] = get_color(layer['paint']['line-color'], feature)
-                                
-                            if 'line-width' in layer['paint']:
-                                feature_style['stroke-width'] = get_value(layer['paint']['line-width'], feature) * 8
-                            
-                            if 'line-opacity' in layer['paint']:
-                                feature_style['stroke-opacity'] = get_value(layer['paint']['line-opacity'], feature)
-                            
-                            if 'line-dasharray' in layer['paint']:
-                                if not isinstance(layer['paint']['line-dasharray'], list):
-                                    raise TypeError()
-                                
-                                dasharray_str = ''
-                                for dash in layer['paint']['line-dasharray']:
-                                    dasharray_str += '{} '.format(dash)
-                                    
-                                feature_style['stroke-dasharray'] = dasharray_str
-                        
-                        if 'layout' in layer:
-                            if 'line-cap' in layer['layout']:
-                                feature_style['stroke-linecap'] = get_value(layer['layout']['line-cap'], feature)
-                                
-                            if 'line-join' in layer['layout']:
-                                feature_style['stroke-linejoin'] = get_value(layer['layout']['line-join'], feature)
-                        
-                        draw_geometry(f, feature, feature_style)
-                    elif layer['type'] == 'symbol':
-                        draw_symbol(f, feature, layer['layout'], layer['paint'])
+            for feature, values in filter_features(plan_layer, source_layer['features'], context, columns):
+                if layer['type'] == 'fill' or layer['type'] == 'line':
+                    draw_geometry(f, feature, get_feature_style(layer, paint, layout, feature, context, values), context)
+                elif layer['type'] == 'symbol':
+                    draw_symbol(f, feature, layout, paint, context)
             
+            context.flush_path(f)
             f.write('</g>')
     
     f.write('</g>')
         
     if draw_full_svg:
-        f.write('</svg>')
+        output.write('<?xml version="1.0" encoding="UTF-8" standalone="no"?>\n')
+        output.write('<svg width="4096" height="4096" viewBox="0 0 4096 4096" xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" xmlns:inkscape="http://www.inkscape.org/namespaces/inkscape" xmlns:sodipodi="http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd"><style>\n{}</style>\n'.format(context.stylesheet.css()))
+        if context.stylesheet.sprites:
+            output.write('<defs>\n{}</defs>\n'.format(context.stylesheet.defs()))
+        output.write('<sodipodi:namedview id="namedview1" pagecolor="#ffffff" bordercolor="#cccccc" borderopacity="1" inkscape:deskcolor="#e5e5e5"/>\n')
+        output.write(f.getvalue())
+        output.write('</svg>')
+    
+    if fp == None:
+        result = output.getvalue()
+        output.close()
+        return result
+
+def join_lines(lines):
+    # 타일 경계에서 잘린 선을 다시 이음: 경계 위의 끝점을 정확히 두 선이 공유할 때만 연결
+    # (첫 조각의 번호, 이은 선) 목록을 반환하며, 첫 조각은 이은 선을 이루는 조각 중 번호가 가장 작은 조각
+    ends = {}
+    for i, line in enumerate(lines):
+        for point in (line[0], line[-1]):
+            if point[0] % 4096 == 0 or point[1] % 4096 == 0:
+                ends.setdefault(point, []).append(i)
+    
+    used = [False] * len(lines)
+    
+    def find_partner(point):
+        candidates = ends.get(point, [])
+        if len(candidates) != 2:
+            return None
+        
+        unused = [i for i in candidates if not used[i]]
+        if len(unused) != 1:
+            return None
+        
+        return unused[0]
+    
+    result = []
+    
+    for i in range(len(lines)):
+        if used[i]:
+            continue
+        
+        used[i] = True
+        line = list(lines[i])
+        
+        while True:
+            j = find_partner(line[-1])
+            if j == None:
+                break
+            
+            used[j] = True
+            line += lines[j][1:] if lines[j][0] == line[-1] else lines[j][-2::-1]
+        
+        while True:
+            j = find_partner(line[0])
+            if j == None:
+                break
+            
+            used[j] = True
+            line = (lines[j][:-1] if lines[j][-1] == line[0] else lines[j][:0:-1]) + line
+        
+        result.append((i, line))
+    
+    return result
+
+def intersect_rect(rect1, rect2):
+    if rect2 == None:
+        return rect1
+    return (max(rect1[0], rect2[0]), max(rect1[1], rect2[1]), min(rect1[2], rect2[2]), min(rect1[3], rect2[3]))
+
+def render_tiles(styles, tiles, zoom, tile_range, clip_rects = None, stylesheet = None, fp = None, vectorize = False):
+    # 여러 타일을 하나의 좌표계로 이어 붙여서 레이어마다 한 번씩만 출력
+    # 좌표계는 (tile_x1, tile_y1) 타일의 왼쪽 위가 원점이며, 타일 하나의 크기는 4096
+    # 면은 타일 경계를 조금 넘겨서 자르고, 선은 경계에서 정확히 잘라서 다시 이음
+    # 라벨은 타일 영역 안에 있는 것만 그려서 중복을 없앰
+    tile_x1, tile_y1, tile_x2, tile_y2 = tile_range
+    width = (tile_x2 - tile_x1 + 1) * 4096
+    height = (tile_y2 - tile_y1 + 1) * 4096
+    
+    if clip_rects == None:
+        clip_rects = {}
+    
+    if fp == None:
+        f = io.StringIO()
+    else:
+        f = fp
+    
+    context = TileRenderContext(tile_x1, tile_y1, zoom, stylesheet = stylesheet, merge_paths = True)
+    columns_cache = {} if vectorize and numpy != None else None
+    tile_offsets = {}
+    
+    for (x, y) in tiles:
+        tile_offsets[(x, y)] = ((x - tile_x1) * 4096, (tile_y2 - y) * 4096)
+    
+    f.write('<g id="map" transform="scale(1, -1) translate(0, -{})">'.format(height))
+    
+    for plan_layer in get_render_plan(styles, zoom)['layers']:
+        layer = plan_layer['layer']
+        paint = plan_layer['paint']
+        layout = plan_layer['layout']
+        
+        if layer['type'] == 'background':
+            if 'background-color' in paint:
+                fill = paint['background-color'](None, context)
+                f.write('<g id="{}"><rect x="0" y="0" width="{}" height="{}" fill="{}" /></g>'.format(layer['id'], width, height, fill))
+            continue
+        
+        sources = [(tile_xy, tile[layer['source-layer']]) for tile_xy, tile in tiles.items() if layer['source-layer'] in tile]
+        if not sources:
+            continue
+        
+        f.write('<g id="{}">'.format(layer['id']))
+        paths = []
+        
+        for tile_xy, source_layer in sources:
+            offset_x, offset_y = tile_offsets[tile_xy]
+            
+            if layer['type'] == 'line':
+                clip_rect = intersect_rect((0, 0, 4096, 4096), clip_rects.get(tile_xy))
+            elif layer['type'] == 'fill':
+                clip_rect = intersect_rect((-16, -16, 4112, 4112), clip_rects.get(tile_xy))
+            else:
+                clip_rect = intersect_rect((0, 0, 4095, 4095), clip_rects.get(tile_xy))
+            
+            columns = get_feature_columns(columns_cache, (tile_xy, layer['source-layer']), source_layer['features'])
+            
+            for feature, values in filter_features(plan_layer, source_layer['features'], context, columns):
+                geometry = clip_geometry(feature['geometry'], clip_rect)
+                if geometry == None:
+                    continue
+                
+                if layer['type'] == 'fill' or layer['type'] == 'line':
+                    style_class = context.stylesheet.get_class(get_feature_style(layer, paint, layout, feature, context, values))
+                    lines, closed = get_geometry_lines(geometry)
+                    lines = [[(p[0] + offset_x, p[1] + offset_y) for p in line] for line in lines]
+                    paths.append((style_class, lines, closed))
+                elif layer['type'] == 'symbol' and geometry['type'] == 'Point':
+                    coord = geometry['coordinates']
+                    feature = {'geometry': {'type': 'Point', 'coordinates': [coord[0] + offset_x, coord[1] + offset_y]}, 'properties': feature['properties']}
+                    draw_symbol(f, feature, layout, paint, context)
+        
+        if layer['type'] == 'line':
+            # 같은 스타일의 선끼리 모아서 잇고, 이은 선은 첫 조각이 나온 위치에 출력해서 그리는 순서를 유지
+            lines_by_class = {}
+            for order, (style_class, lines, closed) in enumerate(paths):
+                lines_by_class.setdefault(style_class, []).extend((order, line) for line in lines)
+            
+            joined = []
+            for style_class, pieces in lines_by_class.items():
+                for i, line in join_lines([line for order, line in pieces]):
+                    joined.append((pieces[i][0], style_class, line))
+            
+            joined.sort(key = lambda item: item[0])
+            paths = [(style_class, [line], False) for order, style_class, line in joined]
+        
+        for style_class, lines, closed in paths:
+            context.add_path(f, style_class, lines, closed)
+        
+        context.flush_path(f)
+        f.write('</g>')
+    
+    f.write('</g>')
     
     if fp == None:
         result = f.getvalue()
         f.close()
-        return result
\ No newline at end of file
+        return result
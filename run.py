@@ -11,6 +11,7 @@ def main():
     parser = argparse.ArgumentParser(prog='bus_routemap')
     parser.add_argument('search_query')
     parser.add_argument('--style', choices=['light', 'dark'], default='light', required=False)
+    parser.add_argument('--refresh', action='store_true', help='노선 정보 캐시를 무시하고 새로 조회')
     
     try:
         with open('key.json', mode='r', encoding='utf-8') as key_file:
@@ -72,18 +73,7 @@ def main():
     
     print('노선 정보 불러오는 중...')
     try:
-        if route_data['type'] <= 10:
-            bus_stops = bus_api.get_seoul_bus_stops(key, route_data['id'])
-            route_positions = bus_api.get_seoul_bus_route(key, route_data['id'])
-            route_info = bus_api.get_seoul_bus_type(key, route_data['id'])
-        elif route_data['type'] <= 60:
-            bus_stops = bus_api.get_gyeonggi_bus_stops(key, route_data['id'])
-            route_positions = bus_api.get_gyeonggi_bus_route(key, route_data['id'])
-            route_info = bus_api.get_gyeonggi_bus_type(key, route_data['id'])
-        else:
-            route_positions, route_bims_id = bus_api.get_busan_bus_route(route_data['name'])
-            bus_stops = bus_api.get_busan_bus_stops(key, route_data['id'], route_bims_id)
-            route_info = bus_api.get_busan_bus_type(key, route_bims_id)
+        route_positions, route_info, bus_stops = bus_api.fetch_route_bundle(key, bus_api.convert_type_to_region_id(route_data['type']), route_data['id'], route_data['name'], refresh = args.refresh)
     except requests.exceptions.ConnectTimeout:
         print('Request Timeout')
         return
@@ -139,7 +129,7 @@ def main():
         
         if draw_background_map:
             if mapbox_key:
-                f.write(bus_api.get_mapbox_map(routemap.mapframe, mapbox_key, mapbox_style))
+                bus_api.get_mapbox_map(routemap.mapframe, mapbox_key, mapbox_style, fp = f, stitch_tiles = True)
             elif naver_key_id and naver_key:
                 f.write(bus_api.get_naver_map(routemap.mapframe, naver_key_id, naver_key))
             else:
@@ -0,0 +1,717 @@
+import os, json, time, argparse, sqlite3, threading, tempfile, contextlib
+
+@contextlib.contextmanager
+def atomic_write(path, mode = 'w'):
+    # 같은 폴더에 고유한 이름의 임시 파일로 쓴 뒤 교체, 같은 항목을 동시에 써도 서로의 임시 파일을 건드리지 않음
+    fd, temp_path = tempfile.mkstemp(dir = os.path.dirname(path) or '.', suffix = '.tmp')
+    
+    try:
+        with os.fdopen(fd, mode = mode, encoding = None if 'b' in mode else 'utf-8') as f:
+            yield f
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+def read_usage(usage_path):
+    # 마지막 정리 이후의 사용량 추정치: {'bytes': 고정되지 않은 항목의 크기, 'pruned': 마지막 전체 정리 시각}
+    try:
+        with open(usage_path, mode='r', encoding='utf-8') as f:
+            usage = json.load(f)
+        return usage if 'bytes' in usage and 'pruned' in usage else None
+    except (OSError, ValueError):
+        return None
+
+def write_usage(usage_path, usage):
+    try:
+        with atomic_write(usage_path) as f:
+            json.dump(usage, f)
+    except OSError:
+        pass
+
+def add_usage(usage_path, written_bytes):
+    # 새로 저장한 크기만 더함, 덮어쓴 항목도 더하므로 실제보다 크게 추정됨
+    usage = read_usage(usage_path)
+    if usage != None:
+        usage['bytes'] += written_bytes
+        write_usage(usage_path, usage)
+
+def is_prune_needed(usage_path, max_bytes, interval):
+    # 사용량 기록이 없거나, 정리한 지 interval이 지났거나, 추정치가 용량 한도를 넘으면 전체 정리
+    usage = read_usage(usage_path)
+    
+    if usage == None or time.time() - usage['pruned'] >= interval:
+        return True
+    
+    return max_bytes != None and usage['bytes'] > max_bytes
+
+class TileStore():
+    # max_bytes: 캐시 용량 한도(바이트), ttl: 항목 유효 기간(초), None이면 제한 없음
+    # prune_interval: prune_if_needed에서 전체 정리 사이의 최소 간격(초)
+    def __init__(self, cache_dir, max_bytes = None, ttl = None, prune_interval = 3600):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.prune_interval = prune_interval
+        self.lock = threading.Lock()
+        self.pending_pins = []
+        # 고정 목록 파일에 이미 있는 경로, 처음 flush할 때 읽음
+        self.pins = None
+        self.written_bytes = 0
+        self.usage_path = os.path.join(cache_dir, 'usage.json')
+    
+    def tile_path(self, source, x, y, zoom):
+        # 원본 벡터 타일(MVT)은 스타일과 무관하게 타일셋 소스별로 저장
+        return os.path.join(self.cache_dir, 'mvt', source.replace('/', '_'), 'tile{}-{}-z{}.mvt'.format(x, y, zoom))
+    
+    def check_entry(self, f, path):
+        # 수정 시각은 저장 시각(TTL 기준), 접근 시각은 LRU 기준으로 사용
+        # noatime 마운트에서도 동작하도록 접근 시각은 직접 기록
+        now = time.time()
+        stat = os.fstat(f.fileno())
+        
+        if self.ttl != None and now - stat.st_mtime > self.ttl:
+            return False
+        
+        try:
+            os.utime(path, (now, stat.st_mtime))
+        except OSError:
+            pass
+        
+        return True
+    
+    def get_tile(self, source, x, y, zoom):
+        tile_path = self.tile_path(source, x, y, zoom)
+        
+        try:
+            with open(tile_path, mode='rb') as f:
+                if not self.check_entry(f, tile_path):
+                    return None
+                return f.read()
+        except FileNotFoundError:
+            return None
+    
+    def put_tile(self, source, x, y, zoom, data):
+        tile_path = self.tile_path(source, x, y, zoom)
+        tile_dir = os.path.dirname(tile_path)
+        if not os.path.exists(tile_dir):
+            os.makedirs(tile_dir, exist_ok = True)
+        
+        with atomic_write(tile_path, mode='wb') as f:
+            f.write(data)
+        
+        with self.lock:
+            self.written_bytes += len(data)
+    
+    def fragment_path(self, style_id, x, y, zoom, clip_rect = None):
+        # 렌더링된 SVG 조각은 스타일별로 저장, 잘린 타일은 잘린 영역별로 따로 저장
+        if clip_rect:
+            filename = 'tile{}-{}-z{}-clip{}_{}_{}_{}.frag'.format(x, y, zoom, *clip_rect)
+        else:
+            filename = 'tile{}-{}-z{}.frag'.format(x, y, zoom)
+        
+        return os.path.join(self.cache_dir, style_id.replace('/', '_'), filename)
+    
+    def get_fragment(self, style_id, x, y, zoom, clip_rect = None, merge_paths = None):
+        # 첫 줄은 JSON 헤더(CSS 규칙, 스타일/렌더러 리비전, 경로 병합 여부), 나머지는 <svg> 없는 본문
+        # merge_paths를 지정하면 경로 병합 여부가 다르게 렌더링된 조각은 없는 것으로 취급
+        fragment_path = self.fragment_path(style_id, x, y, zoom, clip_rect)
+        
+        try:
+            with open(fragment_path, mode='r', encoding='utf-8') as f:
+                if not self.check_entry(f, fragment_path):
+                    return None
+                header = json.loads(f.readline())
+                if merge_paths != None and header.get('merge_paths') != merge_paths:
+                    return None
+                return header, f.read()
+        except (FileNotFoundError, ValueError):
+            return None
+    
+    def put_fragment(self, style_id, x, y, zoom, body, css, revision = None, clip_rect = None, sprites = None, merge_paths = True, renderer = None):
+        fragment_path = self.fragment_path(style_id, x, y, zoom, clip_rect)
+        fragment_dir = os.path.dirname(fragment_path)
+        if not os.path.exists(fragment_dir):
+            os.makedirs(fragment_dir, exist_ok = True)
+        
+        header = {'css': css, 'revision': revision, 'sprites': sprites or [], 'merge_paths': merge_paths, 'renderer': renderer}
+        
+        with atomic_write(fragment_path) as f:
+            f.write(json.dumps(header) + '\n')
+            f.write(body)
+        
+        with self.lock:
+            self.written_bytes += len(body.encode('utf-8')) + len(css.encode('utf-8'))
+    
+    def pins_path(self):
+        return os.path.join(self.cache_dir, 'pinned.txt')
+    
+    def pin(self, source, style_id, x, y, zoom):
+        # 미리 받은 타일(원본 MVT와 잘리지 않은 조각)은 용량 한도로 삭제하지 않음, 만료는 그대로 적용
+        # 고정 목록은 캐시 폴더 기준 상대 경로로 flush할 때 파일에 추가
+        paths = [self.tile_path(source, x, y, zoom), self.fragment_path(style_id, x, y, zoom)]
+        
+        with self.lock:
+            self.pending_pins.extend(os.path.relpath(path, self.cache_dir) for path in paths)
+    
+    def read_pin_lines(self):
+        try:
+            with open(self.pins_path(), mode='r', encoding='utf-8') as f:
+                return [line.rstrip('\n') for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+    
+    def load_pins(self):
+        return set(self.read_pin_lines())
+    
+    def write_pins(self, pins):
+        with atomic_write(self.pins_path()) as f:
+            f.writelines(path + '\n' for path in sorted(pins))
+    
+    def entries(self):
+        # 타일 파일만 대상, 스타일 JSON(styles/)은 자체 TTL로 관리하므로 제외
+        for root, dirs, files in os.walk(self.cache_dir):
+            if root == self.cache_dir and 'styles' in dirs:
+                dirs.remove('styles')
+            
+            for filename in files:
+                if not filename.endswith(('.mvt', '.frag', '.svg')):
+                    continue
+                
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                
+                yield path, stat.st_size, stat.st_atime, stat.st_mtime
+    
+    def stats(self):
+        now = time.time()
+        result = {'entries': 0, 'bytes': 0, 'expired': 0, 'pinned': 0, 'oldest_access': None, 'newest_access': None, 'groups': {}}
+        pins = self.load_pins()
+        
+        for path, size, atime, mtime in self.entries():
+            result['entries'] += 1
+            result['bytes'] += size
+            
+            if self.ttl != None and now - mtime > self.ttl:
+                result['expired'] += 1
+            
+            if os.path.relpath(path, self.cache_dir) in pins:
+                result['pinned'] += 1
+            
+            if result['oldest_access'] == None or atime < result['oldest_access']:
+                result['oldest_access'] = atime
+            if result['newest_access'] == None or atime > result['newest_access']:
+                result['newest_access'] = atime
+            
+            # mvt/<source> 또는 <style> 단위로 집계
+            group = os.path.relpath(os.path.dirname(path), self.cache_dir)
+            entries, size_sum = result['groups'].get(group, (0, 0))
+            result['groups'][group] = (entries + 1, size_sum + size)
+        
+        return result
+    
+    def prune(self, max_bytes = None, ttl = None):
+        # 만료된 항목을 먼저 지우고, 용량 한도를 넘으면 가장 오래 전에 사용한 항목부터 삭제
+        # 고정된 항목은 용량 한도로 삭제하지 않고, 용량 한도는 고정되지 않은 항목에만 적용
+        if max_bytes == None:
+            max_bytes = self.max_bytes
+        if ttl == None:
+            ttl = self.ttl
+        
+        self.flush()
+        pin_lines = self.read_pin_lines()
+        pins = set(pin_lines)
+        unpinned = set()
+        
+        now = time.time()
+        entries = []
+        removed = 0
+        removed_bytes = 0
+        
+        for path, size, atime, mtime in self.entries():
+            relpath = os.path.relpath(path, self.cache_dir)
+            
+            if ttl != None and now - mtime > ttl:
+                if self.remove_entry(path):
+                    removed += 1
+                    removed_bytes += size
+                if relpath in pins:
+                    unpinned.add(relpath)
+            elif not relpath in pins:
+                entries.append((atime, size, path))
+        
+        total_bytes = sum(size for atime, size, path in entries)
+        
+        if max_bytes != None:
+            entries.sort()
+            
+            for atime, size, path in entries:
+                if total_bytes <= max_bytes:
+                    break
+                
+                if self.remove_entry(path):
+                    removed += 1
+                    removed_bytes += size
+                total_bytes -= size
+        
+        # 만료되어 삭제된 항목은 고정 목록에서도 제외하고, 다른 프로세스가 중복해서 추가한 경로는 합침
+        if unpinned or len(pin_lines) != len(pins):
+            with self.lock:
+                self.pins = pins - unpinned
+                self.write_pins(self.pins)
+        
+        write_usage(self.usage_path, {'bytes': total_bytes, 'pruned': now})
+        
+        return removed, removed_bytes
+    
+    def prune_if_needed(self):
+        # 렌더링할 때마다 캐시 폴더 전체를 읽지 않도록, 사용량 추정치로 필요할 때만 정리
+        self.flush()
+        
+        if not is_prune_needed(self.usage_path, self.max_bytes, self.prune_interval):
+            return 0, 0
+        
+        return self.prune()
+    
+    def remove_entry(self, path):
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
+    
+    def flush(self):
+        with self.lock:
+            if self.written_bytes:
+                add_usage(self.usage_path, self.written_bytes)
+                self.written_bytes = 0
+            
+            if not self.pending_pins:
+                return
+            
+            # 이미 고정된 경로는 다시 추가하지 않음
+            if self.pins == None:
+                self.pins = self.load_pins()
+            
+            new_pins = [path for path in dict.fromkeys(self.pending_pins) if not path in self.pins]
+            self.pending_pins = []
+            
+            if not new_pins:
+                return
+            
+            os.makedirs(self.cache_dir, exist_ok = True)
+            with open(self.pins_path(), mode='a', encoding='utf-8') as f:
+                f.writelines(path + '\n' for path in new_pins)
+            
+            self.pins.update(new_pins)
+    
+    def close(self):
+        self.flush()
+
+class MBTilesStore():
+    # 원본 MVT와 렌더링된 조각을 하나의 SQLite 파일(MBTiles 구조)에 저장
+    # tiles 테이블은 MBTiles 규격의 열에 타일셋 소스와 저장/접근 시각, 고정 여부를 추가
+    # 쓰기는 batch_size개가 모이거나 첫 쓰기 후 batch_seconds가 지나면 커밋
+    def __init__(self, filename, max_bytes = None, ttl = None, prune_interval = 3600, batch_size = 64, batch_seconds = 2):
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.prune_interval = prune_interval
+        self.batch_size = batch_size
+        self.batch_seconds = batch_seconds
+        self.pending = 0
+        self.pending_since = None
+        self.lock = threading.Lock()
+        # 읽기는 쓰기 잠금을 잡지 않도록 접근 시각을 메모리에 모았다가 flush에서 기록
+        self.accessed_tiles = {}
+        self.accessed_fragments = {}
+        self.written_bytes = 0
+        self.usage_path = filename + '-usage.json'
+        
+        file_dir = os.path.dirname(filename)
+        if file_dir and not os.path.exists(file_dir):
+            os.makedirs(file_dir, exist_ok = True)
+        
+        # 여러 스레드에서 공유하고, 접근은 lock으로 직렬화
+        self.db = sqlite3.connect(filename, check_same_thread = False)
+        self.db.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        self.db.execute('PRAGMA journal_mode = WAL')
+        self.db.execute('PRAGMA synchronous = NORMAL')
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS tiles (source TEXT, zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB, fetched REAL, accessed REAL, pinned INTEGER DEFAULT 0);
+            CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles (source, zoom_level, tile_column, tile_row);
+            CREATE TABLE IF NOT EXISTS fragments (style_id TEXT, zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, clip TEXT, css TEXT, revision TEXT, body TEXT, fetched REAL, accessed REAL, sprites TEXT, pinned INTEGER DEFAULT 0, merge_paths INTEGER, renderer INTEGER);
+            CREATE UNIQUE INDEX IF NOT EXISTS fragment_index ON fragments (style_id, zoom_level, tile_column, tile_row, clip);
+            INSERT OR IGNORE INTO metadata VALUES ('name', 'bus_routemap'), ('format', 'pbf');
+        ''')
+        
+        # 스프라이트, 고정 여부, 경로 병합 여부, 렌더러 버전 열이 없는 이전 파일은 열을 추가
+        columns = [row[1] for row in self.db.execute('PRAGMA table_info(fragments)')]
+        if not 'sprites' in columns:
+            self.db.execute('ALTER TABLE fragments ADD COLUMN sprites TEXT')
+        if not 'pinned' in columns:
+            self.db.execute('ALTER TABLE fragments ADD COLUMN pinned INTEGER DEFAULT 0')
+        if not 'merge_paths' in columns:
+            self.db.execute('ALTER TABLE fragments ADD COLUMN merge_paths INTEGER')
+        if not 'renderer' in columns:
+            self.db.execute('ALTER TABLE fragments ADD COLUMN renderer INTEGER')
+        
+        columns = [row[1] for row in self.db.execute('PRAGMA table_info(tiles)')]
+        if not 'pinned' in columns:
+            self.db.execute('ALTER TABLE tiles ADD COLUMN pinned INTEGER DEFAULT 0')
+        
+        self.db.commit()
+    
+    def tile_key(self, x, y, zoom):
+        # MBTiles는 TMS 방식이므로 y축을 뒤집어서 저장
+        return zoom, x, 2 ** zoom - 1 - y
+    
+    def clip_key(self, clip_rect):
+        return '{}_{}_{}_{}'.format(*clip_rect) if clip_rect else ''
+    
+    def is_expired(self, fetched, now):
+        return self.ttl != None and now - fetched > self.ttl
+    
+    def write(self, sql, params):
+        # 쓰기는 여러 개를 모아서 한 트랜잭션으로 커밋
+        self.db.execute(sql, params)
+        
+        if self.pending == 0:
+            self.pending_since = time.time()
+        self.pending += 1
+        
+        self.commit_if_due()
+    
+    def commit_if_due(self):
+        # 쓰기 트랜잭션이 열려 있는 동안은 다른 프로세스가 쓸 수 없으므로 오래 열어 두지 않음
+        if self.pending >= self.batch_size or (self.pending and time.time() - self.pending_since >= self.batch_seconds):
+            self.commit()
+    
+    def commit(self):
+        self.db.commit()
+        self.pending = 0
+        self.pending_since = None
+    
+    def write_accessed(self):
+        # 기록하지 못한 접근 시각은 다음 flush에서 다시 기록, 그 사이 새로 접근한 시각이 우선
+        accessed_tiles, self.accessed_tiles = self.accessed_tiles, {}
+        accessed_fragments, self.accessed_fragments = self.accessed_fragments, {}
+        
+        try:
+            self.db.executemany('UPDATE tiles SET accessed = ? WHERE source = ? AND zoom_level = ? AND tile_column = ? AND tile_row = ?', [(now,) + key for key, now in accessed_tiles.items()])
+            self.db.executemany('UPDATE fragments SET accessed = ? WHERE style_id = ? AND zoom_level = ? AND tile_column = ? AND tile_row = ? AND clip = ?', [(now,) + key for key, now in accessed_fragments.items()])
+        except sqlite3.OperationalError:
+            for key, now in accessed_tiles.items():
+                self.accessed_tiles.setdefault(key, now)
+            for key, now in accessed_fragments.items():
+                self.accessed_fragments.setdefault(key, now)
+            return
+        
+        if accessed_tiles or accessed_fragments:
+            if self.pending == 0:
+                self.pending_since = time.time()
+            self.pending += 1
+    
+    def read_done(self):
+        # 읽기에서는 밀린 커밋만 시도하고, 실패해도 읽은 결과는 그대로 반환
+        try:
+            self.commit_if_due()
+        except sqlite3.OperationalError:
+            pass
+    
+    def get_tile(self, source, x, y, zoom):
+        now = time.time()
+        key = (source,) + self.tile_key(x, y, zoom)
+        
+        with self.lock:
+            row = self.db.execute('SELECT tile_data, fetched FROM tiles WHERE source = ? AND zoom_level = ? AND tile_column = ? AND tile_row = ?', key).fetchone()
+            
+            if row == None or self.is_expired(row[1], now):
+                return None
+            
+            self.accessed_tiles[key] = now
+            self.read_done()
+        
+        return row[0]
+    
+    def put_tile(self, source, x, y, zoom, data):
+        now = time.time()
+        
+        with self.lock:
+            # 다시 저장해도 고정 여부는 유지
+            self.write('''
+                INSERT INTO tiles (source, zoom_level, tile_column, tile_row, tile_data, fetched, accessed) VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (source, zoom_level, tile_column, tile_row) DO UPDATE SET tile_data = excluded.tile_data, fetched = excluded.fetched, accessed = excluded.accessed
+            ''', (source,) + self.tile_key(x, y, zoom) + (data, now, now))
+            self.written_bytes += len(data)
+    
+    def get_fragment(self, style_id, x, y, zoom, clip_rect = None, merge_paths = None):
+        # merge_paths를 지정하면 경로 병합 여부가 다르게 렌더링된 조각은 없는 것으로 취급
+        now = time.time()
+        key = (style_id,) + self.tile_key(x, y, zoom) + (self.clip_key(clip_rect),)
+        
+        with self.lock:
+            row = self.db.execute('SELECT css, revision, body, fetched, sprites, merge_paths, renderer FROM fragments WHERE style_id = ? AND zoom_level = ? AND tile_column = ? AND tile_row = ? AND clip = ?', key).fetchone()
+            
+            if row == None or self.is_expired(row[3], now):
+                return None
+            
+            header = {'css': row[0], 'revision': row[1], 'sprites': json.loads(row[4]) if row[4] else [], 'merge_paths': None if row[5] == None else bool(row[5]), 'renderer': row[6]}
+            if merge_paths != None and header['merge_paths'] != merge_paths:
+                return None
+            
+            self.accessed_fragments[key] = now
+            self.read_done()
+        
+        return header, row[2]
+    
+    def put_fragment(self, style_id, x, y, zoom, body, css, revision = None, clip_rect = None, sprites = None, merge_paths = True, renderer = None):
+        now = time.time()
+        key = (style_id,) + self.tile_key(x, y, zoom) + (self.clip_key(clip_rect),)
+        
+        with self.lock:
+            self.write('''
+                INSERT INTO fragments (style_id, zoom_level, tile_column, tile_row, clip, css, revision, body, fetched, accessed, sprites, merge_paths, renderer) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (style_id, zoom_level, tile_column, tile_row, clip) DO UPDATE SET css = excluded.css, revision = excluded.revision, body = excluded.body, fetched = excluded.fetched, accessed = excluded.accessed, sprites = excluded.sprites, merge_paths = excluded.merge_paths, renderer = excluded.renderer
+            ''', key + (css, revision, body, now, now, json.dumps(sprites or []), merge_paths, renderer))
+            self.written_bytes += len(body.encode('utf-8')) + len(css.encode('utf-8'))
+    
+    def pin(self, source, style_id, x, y, zoom):
+        # 미리 받은 타일(원본 MVT와 잘리지 않은 조각)은 용량 한도로 삭제하지 않음, 만료는 그대로 적용
+        tile_key = self.tile_key(x, y, zoom)
+        
+        with self.lock:
+            self.write('UPDATE tiles SET pinned = 1 WHERE source = ? AND zoom_level = ? AND tile_column = ? AND tile_row = ?', (source,) + tile_key)
+            self.write('UPDATE fragments SET pinned = 1 WHERE style_id = ? AND zoom_level = ? AND tile_column = ? AND tile_row = ? AND clip = ?', (style_id,) + tile_key + ('',))
+    
+    def stats(self):
+        now = time.time()
+        result = {'entries': 0, 'bytes': 0, 'expired': 0, 'pinned': 0, 'oldest_access': None, 'newest_access': None, 'groups': {}}
+        
+        with self.lock:
+            rows = self.db.execute('''
+                SELECT 'mvt/' || source, length(tile_data), accessed, fetched, pinned FROM tiles
+                UNION ALL SELECT style_id, length(CAST(body AS BLOB)) + length(CAST(css AS BLOB)), accessed, fetched, pinned FROM fragments
+            ''').fetchall()
+        
+        for group, size, atime, mtime, pinned in rows:
+            result['entries'] += 1
+            result['bytes'] += size
+            
+            if self.is_expired(mtime, now):
+                result['expired'] += 1
+            
+            if pinned:
+                result['pinned'] += 1
+            
+            if result['oldest_access'] == None or atime < result['oldest_access']:
+                result['oldest_access'] = atime
+            if result['newest_access'] == None or atime > result['newest_access']:
+                result['newest_access'] = atime
+            
+            entries, size_sum = result['groups'].get(group, (0, 0))
+            result['groups'][group] = (entries + 1, size_sum + size)
+        
+        return result
+    
+    def prune(self, max_bytes = None, ttl = None):
+        # 만료된 항목을 먼저 지우고, 용량 한도를 넘으면 가장 오래 전에 사용한 항목부터 삭제
+        # 고정된 항목은 용량 한도로 삭제하지 않고, 용량 한도는 고정되지 않은 항목에만 적용
+        if max_bytes == None:
+            max_bytes = self.max_bytes
+        if ttl == None:
+            ttl = self.ttl
+        
+        now = time.time()
+        removed = 0
+        removed_bytes = 0
+        
+        with self.lock:
+            self.write_accessed()
+            rows = self.db.execute('''
+                SELECT 'tiles', rowid, length(tile_data), accessed, fetched, pinned FROM tiles
+                UNION ALL SELECT 'fragments', rowid, length(CAST(body AS BLOB)) + length(CAST(css AS BLOB)), accessed, fetched, pinned FROM fragments
+                ORDER BY accessed
+            ''').fetchall()
+            
+            removed_rows = []
+            entries = []
+            
+            for table, rowid, size, atime, mtime, pinned in rows:
+                if ttl != None and now - mtime > ttl:
+                    removed_rows.append((table, rowid, size))
+                elif not pinned:
+                    entries.append((table, rowid, size))
+            
+            total_bytes = sum(size for table, rowid, size in entries)
+            
+            if max_bytes != None:
+                for table, rowid, size in entries:
+                    if total_bytes <= max_bytes:
+                        break
+                    
+                    removed_rows.append((table, rowid, size))
+                    total_bytes -= size
+            
+            for table, rowid, size in removed_rows:
+                self.db.execute('DELETE FROM {} WHERE rowid = ?'.format(table), (rowid,))
+                removed += 1
+                removed_bytes += size
+            
+            self.commit()
+            self.written_bytes = 0
+            
+            if removed_rows:
+                self.db.execute('PRAGMA incremental_vacuum')
+        
+        write_usage(self.usage_path, {'bytes': total_bytes, 'pruned': now})
+        
+        return removed, removed_bytes
+    
+    def prune_if_needed(self):
+        # 렌더링할 때마다 전체 항목을 읽지 않도록, 사용량 추정치로 필요할 때만 정리
+        self.flush()
+        
+        if not is_prune_needed(self.usage_path, self.max_bytes, self.prune_interval):
+            return 0, 0
+        
+        return self.prune()
+    
+    def flush(self):
+        with self.lock:
+            self.write_accessed()
+            
+            try:
+                self.commit()
+            except sqlite3.OperationalError:
+                # 다른 프로세스가 쓰는 중이면 트랜잭션을 유지하고 다음 flush에서 다시 커밋
+                return
+            
+            if self.written_bytes:
+                add_usage(self.usage_path, self.written_bytes)
+                self.written_bytes = 0
+    
+    def close(self):
+        self.flush()
+        self.db.close()
+
+def open_tile_store(cache_dir, mbtiles = None, max_bytes = None, ttl = None, prune_interval = 3600):
+    # mbtiles 파일을 지정하면 파일별 캐시 대신 SQLite 저장소 사용
+    if mbtiles:
+        return MBTilesStore(mbtiles, max_bytes = max_bytes, ttl = ttl, prune_interval = prune_interval)
+    
+    return TileStore(cache_dir, max_bytes = max_bytes, ttl = ttl, prune_interval = prune_interval)
+
+def format_size(size):
+    for unit in ['B', 'KB', 'MB']:
+        if size < 1024:
+            return '{:.1f} {}'.format(size, unit)
+        size /= 1024
+    
+    return '{:.1f} GB'.format(size)
+
+def format_time(timestamp):
+    if timestamp == None:
+        return '-'
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))
+
+def seed(parser, args):
+    # bus_api가 이 모듈을 사용하므로 seed 명령에서만 가져옴
+    import bus_api
+    
+    if args.bbox:
+        bbox = tuple(args.bbox)
+        region = 'bbox'
+    elif args.region:
+        bbox = bus_api.seed_regions[args.region]
+        region = args.region
+    else:
+        parser.error('seed에는 지역 또는 --bbox가 필요합니다.')
+    
+    if args.style == 'light':
+        mapbox_style = 'kiwitree/clinp1vgh002t01q4c2366q3o'
+    elif args.style == 'dark':
+        mapbox_style = 'kiwitree/clirdaqpr00hu01pu8t7vhmq7'
+    else:
+        mapbox_style = args.style
+    
+    try:
+        with open('key.json', mode='r', encoding='utf-8') as key_file:
+            mapbox_key = json.load(key_file)['mapbox_key']
+    except (FileNotFoundError, KeyError):
+        parser.error('key.json에 mapbox_key를 저장하십시오.')
+    
+    bus_api.cache_dir = args.cache_dir
+    bus_api.cache_mbtiles = args.mbtiles
+    
+    manifest_filename = args.manifest
+    if manifest_filename == None:
+        manifest_filename = os.path.join(args.cache_dir, 'seed-{}-{}.json'.format(mapbox_style.replace('/', '_'), region))
+    
+    def progress(done, total, failed):
+        print('\r{}/{} 완료, {} 실패'.format(done, total, failed), end='', flush=True)
+    
+    done, total, failed = bus_api.seed_mapbox_tiles(mapbox_key, mapbox_style, bbox, min_level = args.zoom[0], max_level = args.zoom[1], max_workers = args.workers, refresh = args.refresh, manifest_filename = manifest_filename, progress = progress)
+    print()
+    
+    for tile, e in failed:
+        print('tile{}-{}-z{}: {}'.format(*tile, e))
+
+def main():
+    options = argparse.ArgumentParser(add_help=False)
+    options.add_argument('--cache-dir', default='cache')
+    options.add_argument('--max-bytes', type=int, default=None, help='캐시 용량 한도(바이트)')
+    options.add_argument('--ttl', type=float, default=None, help='항목 유효 기간(초)')
+    options.add_argument('--mbtiles', default=None, help='SQLite(MBTiles) 캐시 파일')
+    
+    parser = argparse.ArgumentParser(prog='cache')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('stats', parents=[options])
+    subparsers.add_parser('prune', parents=[options])
+    
+    seed_parser = subparsers.add_parser('seed', parents=[options])
+    seed_parser.add_argument('region', nargs='?', choices=['seoul', 'gyeonggi', 'busan'])
+    seed_parser.add_argument('--bbox', type=float, nargs=4, metavar=('WEST', 'SOUTH', 'EAST', 'NORTH'))
+    seed_parser.add_argument('--zoom', type=int, nargs=2, metavar=('MIN', 'MAX'), default=[11, 14])
+    seed_parser.add_argument('--style', default='light', help='light, dark 또는 Mapbox 스타일 ID')
+    seed_parser.add_argument('--workers', type=int, default=8)
+    seed_parser.add_argument('--refresh', action='store_true', help='캐시에 있는 타일도 새로 받음')
+    seed_parser.add_argument('--manifest', default=None, help='진행 상황 파일')
+    
+    args = parser.parse_args()
+    
+    if args.command == 'seed':
+        seed(parser, args)
+        return
+    
+    tile_store = open_tile_store(args.cache_dir, mbtiles = args.mbtiles, max_bytes = args.max_bytes, ttl = args.ttl)
+    
+    if args.command == 'stats':
+        stats = tile_store.stats()
+        
+        for group, (entries, size) in sorted(stats['groups'].items()):
+            print('{}: {}개, {}'.format(group, entries, format_size(size)))
+        
+        print('전체: {}개, {}'.format(stats['entries'], format_size(stats['bytes'])))
+        print('고정: {}개'.format(stats['pinned']))
+        if args.ttl != None:
+            print('만료: {}개'.format(stats['expired']))
+        print('마지막 사용: {} ~ {}'.format(format_time(stats['oldest_access']), format_time(stats['newest_access'])))
+    elif args.command == 'prune':
+        if args.max_bytes == None and args.ttl == None:
+            parser.error('prune에는 --max-bytes 또는 --ttl이 필요합니다.')
+        
+        removed, removed_bytes = tile_store.prune()
+        print('{}개 삭제, {}'.format(removed, format_size(removed_bytes)))
+    
+    tile_store.close()
+
+if __name__ == '__main__':
+    main()